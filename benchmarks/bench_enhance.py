@@ -0,0 +1,90 @@
+"""
+Old-photo enhancement: ImageEnhance chain vs the fused NumPy path.
+
+    python benchmarks/bench_enhance.py [width] [height]
+
+Runs ImageAnalyzer._enhance_chain and _enhance_fused on a synthetic sepia
+"scan" (default 4000x3000, 12 MP). The scan is built in one subprocess and
+saved as PNG; each path then runs in its own subprocess that only loads it.
+Reports median time, peak RSS growth during the call (ru_maxrss after minus
+before) and whether both outputs are identical. ru_maxrss survives fork and
+exec, so the parent itself stays small.
+"""
+import hashlib
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-enhance-'))
+
+import numpy as np  # noqa: E402
+from PIL import Image, ImageFilter  # noqa: E402
+
+from bot import ImageAnalyzer  # noqa: E402
+
+PATHS = {'chain': ImageAnalyzer._enhance_chain, 'fused': ImageAnalyzer._enhance_fused}
+
+
+def sepia_scan(width, height):
+    rng = np.random.default_rng(1)
+    ramp = np.linspace(0, 255, width, dtype=np.float32)[None, :, None] * np.ones((height, 1, 1), dtype=np.float32)
+    pixels = ramp * np.array([1.0, 0.85, 0.65], dtype=np.float32) + 40
+    pixels += rng.normal(0, 12, (height, width, 1)).astype(np.float32)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    del ramp, pixels
+    return img.filter(ImageFilter.GaussianBlur(2))
+
+
+def run_path(name, scan_file, repeat=3):
+    """Child process: one path only, so ru_maxrss belongs to it alone"""
+    img = Image.open(scan_file)
+    img.load()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = PATHS[name](img)
+        samples.append(time.perf_counter() - started)
+        if len(samples) == 1:
+            # Cho'qqi faqat enhance chaqiruvi uchun - tobytes() nusxasidan oldin
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if len(samples) < repeat:
+            del result
+    digest = hashlib.sha256(result.tobytes()).hexdigest()
+    print(json.dumps({'ms': statistics.median(samples) * 1000, 'rss_mb': (after - before) / 1024, 'digest': digest}))
+
+
+def main():
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    print(f"{width}x{height} sepia scan ({width * height / 1e6:.0f} MP), one subprocess per path\n")
+    
+    # Skan alohida jarayonda yaratiladi - uni yasash cho'qqisi keyingi jarayonlarga o'tmasin
+    scan_file = os.path.abspath('scan.png')
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--scan', scan_file, str(width), str(height)], check=True)
+    
+    results = {}
+    for name in PATHS:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--path', name, scan_file],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results[name] = json.loads(output.strip().splitlines()[-1])
+        print(f"{name}  {results[name]['ms']:7.0f} ms median, peak RSS +{results[name]['rss_mb']:.0f} MB")
+    identical = results['chain']['digest'] == results['fused']['digest']
+    print(f"outputs identical: {identical}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--scan':
+        sepia_scan(int(sys.argv[3]), int(sys.argv[4])).save(sys.argv[2])
+    elif len(sys.argv) > 1 and sys.argv[1] == '--path':
+        run_path(sys.argv[2], sys.argv[3])
+    else:
+        main()
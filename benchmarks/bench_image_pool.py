@@ -0,0 +1,79 @@
+"""
+CPU-bound PIL stages in a thread vs the spawned ImageWorkerPool.
+
+    python benchmarks/bench_image_pool.py [photos] [workers]
+
+Runs the real ImageAnalyzer.enhance_old_photo + prepare_veo_image stages on
+synthetic 3000x2000 "scanned" JPEGs, several at once, while a 10 ms ticker
+measures how late the event loop wakes up (what every other user of the bot
+waits on). Pool start-up (spawn + module import) is reported separately;
+worker log lines go to stderr.
+"""
+import asyncio
+import io
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-image-pool-'))
+
+from PIL import Image, ImageFilter  # noqa: E402
+
+from bot import VEO_MAX_SIDE, ImageAnalyzer, ImageWorkerPool, prepare_veo_image  # noqa: E402
+
+
+def scanned_photo(seed):
+    rng = random.Random(seed)
+    img = Image.effect_noise((3000, 2000), 40).convert('RGB')
+    img = Image.merge('RGB', [band.point(lambda v, k=k: min(255, v + k)) for band, k in
+                              zip(img.split(), (rng.randint(40, 70), rng.randint(20, 40), 0))])
+    buffer = io.BytesIO()
+    img.filter(ImageFilter.GaussianBlur(2)).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def stages(image_bytes):
+    return prepare_veo_image(ImageAnalyzer.enhance_old_photo(image_bytes), VEO_MAX_SIDE)
+
+
+async def measure(pool, photos):
+    lags = []
+    
+    async def ticker():
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append((time.perf_counter() - started - 0.01) * 1000)
+    
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await pool.start()
+    startup = time.perf_counter() - started
+    started = time.perf_counter()
+    await asyncio.gather(*(pool.run(stages, photo) for photo in photos))
+    elapsed = time.perf_counter() - started
+    tick.cancel()
+    pool.shutdown()
+    return startup, elapsed, statistics.median(lags), max(lags)
+
+
+def main():
+    logging.getLogger('bot').setLevel(logging.WARNING)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else min(2, os.cpu_count() or 1)
+    photos = [scanned_photo(seed) for seed in range(count)]
+    print(f"{count} photos, {len(photos[0]) // 1024} KB each, {os.cpu_count()} CPUs\n")
+    
+    for label, pool in (('thread', ImageWorkerPool(0)), (f'pool({workers})', ImageWorkerPool(workers))):
+        startup, elapsed, median, worst = asyncio.run(measure(pool, photos))
+        print(f"{label:9} start {startup * 1000:6.0f} ms, {elapsed / count * 1000:6.0f} ms/photo, "
+              f"loop lag {median:5.1f} ms median, {worst:6.1f} ms max")
+
+
+if __name__ == '__main__':
+    main()
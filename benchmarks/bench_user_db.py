@@ -0,0 +1,78 @@
+"""
+User database at 100k+ users: SQLite (WAL) backend vs the legacy JSON file.
+
+    python benchmarks/bench_user_db.py [users]
+
+Measures per-user insert and per-video update latency, /admin statistics
+(totals, 24h active, top 10) and the one-shot JSON -> SQLite migration.
+Everything runs in a temporary directory.
+"""
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-user-db-'))
+
+from bot import JsonUserBackend, SqliteUserBackend, migrate_json_users  # noqa: E402
+
+
+def user_record(user_id, now):
+    return {
+        'user_id': user_id,
+        'username': f'user{user_id}',
+        'first_name': 'Bench',
+        'videos_created': user_id % 7,
+        'last_video_time': now - (user_id % 172800),
+        'join_date': now - 86400 * 30,
+        'total_requests': user_id % 7
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1e6, max(samples) * 1e6
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    now = time.time()
+    print(f"{users} users\n")
+    
+    sqlite_backend = SqliteUserBackend('users.sqlite3')
+    started = time.perf_counter()
+    for user_id in range(1, users + 1):
+        sqlite_backend.insert(user_record(user_id, now))
+    fill = time.perf_counter() - started
+    print(f"sqlite  insert (per row, own commit): {fill / users * 1e6:8.1f} us avg, total {fill:.1f} s")
+    
+    median, worst = timed(lambda i: sqlite_backend.insert(user_record(users + 1 + i, now)), 500)
+    print(f"sqlite  add_user at {users}:           {median:8.1f} us median, {worst:.0f} us max")
+    median, worst = timed(lambda i: sqlite_backend.record_video(1 + i * 97 % users, now + i), 500)
+    print(f"sqlite  record_video:                  {median:8.1f} us median, {worst:.0f} us max")
+    median, worst = timed(lambda i: (sqlite_backend.stats(time.time() - 86400), sqlite_backend.top_users(10)), 200)
+    print(f"sqlite  /admin stats + top 10:         {median:8.1f} us median, {worst:.0f} us max")
+    
+    # Eski yo'l: har bir yozuvda butun fayl indent=2 bilan qayta yoziladi
+    legacy = {str(user_id): user_record(user_id, now) for user_id in range(1, users + 1)}
+    with open('users_database.json', 'w', encoding='utf-8') as f:
+        json.dump(legacy, f)
+    json_backend = JsonUserBackend('users_database.json')
+    median, worst = timed(lambda i: json_backend.insert(user_record(users + 1 + i, now)), 5)
+    print(f"json    add_user at {users}:           {median / 1000:8.1f} ms median (full-file rewrite)")
+    
+    migrated = SqliteUserBackend('migrated.sqlite3')
+    started = time.perf_counter()
+    count = migrate_json_users('users_database.json', migrated)
+    print(f"migrate {count} users JSON -> SQLite:  {time.perf_counter() - started:8.2f} s")
+
+
+if __name__ == '__main__':
+    main()
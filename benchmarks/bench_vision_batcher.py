@@ -0,0 +1,73 @@
+"""
+Vision micro-batching against a fake Vision server.
+
+    python benchmarks/bench_vision_batcher.py [seconds] [window_ms]
+
+The fake batch_annotate_images sleeps 80 ms + 4 ms per image (no network).
+Poisson arrivals at several rates call VisionBatcher.annotate() from the
+event loop, unbatched (window 0) and batched; reports RPC count and the
+p50/p95 latency seen by a caller.
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-vision-'))
+
+from google.cloud import vision  # noqa: E402
+
+from bot import VisionBatcher  # noqa: E402
+
+
+class FakeVision:
+    def __init__(self):
+        self.rpcs = 0
+    
+    def batch_annotate_images(self, requests, timeout=None):
+        self.rpcs += 1
+        time.sleep(0.080 + 0.004 * len(requests))
+        return SimpleNamespace(responses=[vision.AnnotateImageResponse() for _ in requests])
+
+
+async def run(rate, seconds, window):
+    fake = FakeVision()
+    batcher = VisionBatcher(lambda: fake, window)
+    rng = random.Random(rate)
+    image = vision.AnnotateImageRequest(image=vision.Image(content=b'\0' * 60_000))
+    latencies = []
+    
+    async def one():
+        started = time.perf_counter()
+        await batcher.annotate(image)
+        latencies.append((time.perf_counter() - started) * 1000)
+    
+    tasks = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        tasks.append(asyncio.create_task(one()))
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+    latencies.sort()
+    return len(latencies), fake.rpcs, statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    window = (float(sys.argv[2]) if len(sys.argv) > 2 else 100) / 1000
+    print(f"fake Vision: 80 ms + 4 ms/image, {seconds:.0f} s per rate, window {window * 1000:.0f} ms\n")
+    print("rate/s  requests   unbatched RPCs  p50 / p95 ms    batched RPCs  p50 / p95 ms")
+    for rate in (1, 10, 50, 200):
+        requests, plain_rpcs, plain_p50, plain_p95 = asyncio.run(run(rate, seconds, 0))
+        _, batched_rpcs, batched_p50, batched_p95 = asyncio.run(run(rate, seconds, window))
+        print(f"{rate:6}  {requests:8}   {plain_rpcs:14}  {plain_p50:4.0f} / {plain_p95:4.0f}   "
+              f"{batched_rpcs:12}  {batched_p50:4.0f} / {batched_p95:4.0f}")
+
+
+if __name__ == '__main__':
+    main()
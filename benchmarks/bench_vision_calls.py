@@ -0,0 +1,123 @@
+"""
+Vision request shapes per photo against a fake Vision server.
+
+    python benchmarks/bench_vision_calls.py [photos]
+
+The fake batch_annotate_images models one RPC as 40 ms round trip + upload
+at 20 Mbit/s + per-feature server time (faces 30 ms, labels 25 ms,
+image properties 15 ms, safe search 15 ms). Compared, per photo:
+
+  sequential   4 single-feature RPCs one after another (the original code)
+  combined     1 RPC with faces + labels + image properties
+  staged       current ImageAnalyzer.analyze_image: faces first, labels only
+               if a face was found, colours/age computed locally
+  unstaged     current analyze_image with VISION_STAGED=false (faces + labels)
+
+Half of the photos have a face. Everything runs in-process, sequentially.
+"""
+import asyncio
+import io
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-vision-calls-'))
+
+import numpy as np  # noqa: E402
+from google.cloud import vision  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import bot  # noqa: E402
+from bot import ImageAnalyzer, VisionBatcher  # noqa: E402
+
+Type = vision.Feature.Type
+FEATURE_MS = {Type.FACE_DETECTION: 30, Type.LABEL_DETECTION: 25, Type.IMAGE_PROPERTIES: 15, Type.SAFE_SEARCH_DETECTION: 15}
+
+
+class FakeVision:
+    def __init__(self):
+        self.rpcs = 0
+        self.uploaded = 0
+        self.faces = False  # joriy rasmda yuz bormi
+    
+    def batch_annotate_images(self, requests, timeout=None):
+        size = sum(len(request.image.content) for request in requests)
+        server_ms = sum(FEATURE_MS[feature.type_] for request in requests for feature in request.features)
+        self.rpcs += 1
+        self.uploaded += size
+        time.sleep(0.040 + size * 8 / 20e6 + server_ms / 1000)
+        
+        responses = []
+        for request in requests:
+            types = {feature.type_ for feature in request.features}
+            responses.append(vision.AnnotateImageResponse(
+                face_annotations=[vision.FaceAnnotation()] if self.faces and Type.FACE_DETECTION in types else [],
+                label_annotations=[vision.EntityAnnotation(description='person')] if Type.LABEL_DETECTION in types else []
+            ))
+        return vision.BatchAnnotateImagesResponse(responses=responses)
+
+
+def photo_bytes():
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    img = Image.fromarray(pixels).resize((1280, 960), Image.Resampling.BICUBIC)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def request(image_bytes, *types):
+    features = [vision.Feature(type_=t, max_results=15 if t == Type.LABEL_DETECTION else 3) for t in types]
+    return vision.AnnotateImageRequest(image=vision.Image(content=image_bytes), features=features)
+
+
+async def sequential(fake, image_bytes):
+    for t in (Type.FACE_DETECTION, Type.LABEL_DETECTION, Type.IMAGE_PROPERTIES, Type.SAFE_SEARCH_DETECTION):
+        await asyncio.to_thread(fake.batch_annotate_images, [request(image_bytes, t)])
+
+
+async def combined(fake, image_bytes):
+    await asyncio.to_thread(
+        fake.batch_annotate_images,
+        [request(image_bytes, Type.FACE_DETECTION, Type.LABEL_DETECTION, Type.IMAGE_PROPERTIES)]
+    )
+
+
+def analyzer_path(staged):
+    async def run(fake, image_bytes):
+        bot.VISION_STAGED = staged
+        analysis = await ImageAnalyzer(None, VisionBatcher(lambda: fake, window=0)).analyze_image(image_bytes)
+        assert analysis is not None
+    return run
+
+
+async def measure(path, image_bytes, photos):
+    fake = FakeVision()
+    samples = {True: [], False: []}
+    for i in range(photos):
+        fake.faces = i % 2 == 0
+        started = time.perf_counter()
+        await path(fake, image_bytes)
+        samples[fake.faces].append((time.perf_counter() - started) * 1000)
+    return (statistics.median(samples[True]), statistics.median(samples[False]),
+            fake.rpcs / photos, fake.uploaded / photos / 1024)
+
+
+def main():
+    logging.getLogger('bot').setLevel(logging.WARNING)
+    photos = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    image_bytes = photo_bytes()
+    print(f"{photos} photos, {len(image_bytes) // 1024} KB each, half with a face\n")
+    print("path         face ms   no-face ms   RPCs/photo   KB uploaded/photo   (median latency)")
+    for name, path in (('sequential', sequential), ('combined', combined),
+                       ('staged', analyzer_path(True)), ('unstaged', analyzer_path(False))):
+        face, no_face, rpcs, uploaded = asyncio.run(measure(path, image_bytes, photos))
+        print(f"{name:11}  {face:7.0f}   {no_face:10.0f}   {rpcs:10.1f}   {uploaded:17.0f}")
+
+
+if __name__ == '__main__':
+    main()
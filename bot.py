@@ -3,36 +3,71 @@ import time
 import logging
 import random
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import hashlib
+import tempfile
+import contextlib
+import uuid
+import sqlite3
+import heapq
+import itertools
+import hmac
+import signal
+import secrets
+import multiprocessing
+import queue
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
+from collections import OrderedDict, deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
 import requests
+import httpx
 from dotenv import load_dotenv
 import json
 import base64
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
-from PIL import Image
+from PIL import Image, ImageEnhance, ImageFilter
 import io
 from google.cloud import vision
 
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # Load environment variables
 load_dotenv()
 
-# Decode service-account.json from base64 environment variable (Railway deployment)
-SA_BASE64 = os.getenv('SERVICE_ACCOUNT_JSON_BASE64')
-if SA_BASE64:
-    try:
-        import base64
-        sa_json = base64.b64decode(SA_BASE64).decode('utf-8')
-        with open('service-account.json', 'w', encoding='utf-8') as f:
-            f.write(sa_json)
-        print("✅ service-account.json created from base64 environment variable")
-    except Exception as e:
-        print(f"❌ Error creating service-account.json: {e}")
-elif not os.path.exists('service-account.json'):
-    print("⚠️  service-account.json not found!")
-    print("📝 Set SERVICE_ACCOUNT_JSON_BASE64 environment variable or add service-account.json locally")
+
+def write_service_account_file():
+    """
+    Decode service-account.json from base64 environment variable (Railway deployment).
+    Called once from main(): spawned worker processes re-import this module
+    and must not rewrite the file while others read it.
+    """
+    sa_base64 = os.getenv('SERVICE_ACCOUNT_JSON_BASE64')
+    if sa_base64:
+        try:
+            sa_json = base64.b64decode(sa_base64).decode('utf-8')
+            write_file_atomic('service-account.json', sa_json)
+            print("✅ service-account.json created from base64 environment variable")
+        except Exception as e:
+            print(f"❌ Error creating service-account.json: {e}")
+    elif not os.path.exists('service-account.json'):
+        print("⚠️  service-account.json not found!")
+        print("📝 Set SERVICE_ACCOUNT_JSON_BASE64 environment variable or add service-account.json locally")
+
 
 # Configure logging
 logging.basicConfig(
@@ -47,6 +82,19 @@ GOOGLE_PROJECT_ID = os.getenv('GOOGLE_PROJECT_ID')
 GOOGLE_LOCATION = os.getenv('GOOGLE_LOCATION', 'us-central1')
 GOOGLE_SERVICE_ACCOUNT_FILE = os.getenv('GOOGLE_SERVICE_ACCOUNT_FILE', 'service-account.json')
 
+# Update'larni qabul qilish: polling yoki webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Tashqi manzil, masalan https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_PORT = int(os.getenv('PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', '1000'))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+DROP_PENDING_UPDATES = os.getenv('DROP_PENDING_UPDATES', 'false').lower() == 'true'
+
+# Ko'p jarayonli rejim: 0 - bitta jarayon, N - front + N ta worker (user_id bo'yicha)
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '0'))
+
 # Admin configuration
 ADMIN_IDS = [5928372261]  # Shu ID bilan faqat Admin huquqlari
 
@@ -55,14 +103,128 @@ VIDEO_COOLDOWN_HOURS = 6
 VIDEO_COOLDOWN_SECONDS = VIDEO_COOLDOWN_HOURS * 3600
 
 # Database file
-USER_DB_FILE = 'users_database.json'
+USER_DB_FILE = os.getenv('USER_DB_FILE', 'users_database.json')
+USER_DB_BACKEND = os.getenv('USER_DB_BACKEND', 'sqlite')  # sqlite | journal | json
+USER_SQLITE_FILE = os.getenv('USER_SQLITE_FILE', 'users.sqlite3')
 
+# Cooldown rezervatsiyalari - bir nechta replika uchun umumiy (redis | sqlite | memory)
+REDIS_URL = os.getenv('REDIS_URL')
+COOLDOWN_BACKEND = os.getenv('COOLDOWN_BACKEND', 'redis' if REDIS_URL else 'sqlite')
+COOLDOWN_DB_FILE = os.getenv('COOLDOWN_DB_FILE', 'cooldowns.sqlite3')
+# Ish davomida band qilingan slot shu vaqtdan keyin o'z-o'zidan bo'shaydi (crash holati)
+RESERVATION_HOLD_SECONDS = int(os.getenv('RESERVATION_HOLD_SECONDS', '7200'))
+
+# Rezervatsiya holatlari
+RESERVED = 'reserved'
+IN_PROGRESS = 'in_progress'
+COOLDOWN = 'cooldown'
+
+# Shu jarayon ishga tushgan vaqt: undan oldingi pending rezervatsiyalar o'lgan worker'niki
+PROCESS_STARTED_AT = time.time()
+
+
+def write_file_atomic(path, text):
+    """Write via temp file + fsync + rename so a crash never leaves a truncated file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class UserAggregates:
+    """
+    Admin statistics kept up to date on every write instead of full scans:
+    running totals, an exact rolling 24h active-user window (latest video
+    time of each active user plus a time-ordered event queue that is
+    expired as time moves on) and a bounded top-K leaderboard.
+    videos_created only grows, so the top-K set stays exact.
+    """
+
+    def __init__(self, top_k=10, window=86400):
+        self.top_k = top_k
+        self.window = window
+        self.total_users = 0
+        self.total_videos = 0
+        self.active = {}  # user_id -> oxirgi video vaqti (faqat oynadagilar)
+        self.recent = deque()  # (vaqt, user_id), vaqt bo'yicha tartiblangan
+        self.top = {}
+
+    @classmethod
+    def from_users(cls, users, **kwargs):
+        aggregates = cls(**kwargs)
+        cutoff = time.time() - aggregates.window
+        recent = []
+        for user in users:
+            aggregates.add_user(user)
+            aggregates.total_videos += user.get('videos_created', 0)
+            if user.get('last_video_time', 0) > cutoff:
+                recent.append((user['last_video_time'], user['user_id']))
+            aggregates._offer(user['user_id'], user.get('videos_created', 0))
+        for timestamp, user_id in sorted(recent):
+            aggregates.active[user_id] = timestamp
+            aggregates.recent.append((timestamp, user_id))
+        return aggregates
+
+    def _expire(self, cutoff):
+        while self.recent and self.recent[0][0] <= cutoff:
+            timestamp, user_id = self.recent.popleft()
+            # Foydalanuvchining keyingi videosi bo'lsa u hali oynada qoladi
+            if self.active.get(user_id) == timestamp:
+                del self.active[user_id]
+
+    def _offer(self, user_id, videos):
+        if videos <= 0:
+            return
+        if user_id in self.top or len(self.top) < self.top_k:
+            self.top[user_id] = videos
+            return
+        weakest = min(self.top, key=self.top.get)
+        if videos > self.top[weakest]:
+            del self.top[weakest]
+            self.top[user_id] = videos
+
+    def add_user(self, user):
+        self.total_users += 1
+
+    def record_video(self, user_id, now, videos):
+        self.total_videos += 1
+        self.active[user_id] = now
+        self.recent.append((now, user_id))
+        self._expire(now - self.window)
+        self._offer(user_id, videos)
+
+    def active_since(self, active_since):
+        self._expire(active_since)
+        return len(self.active)
+
+    def stats(self, active_since):
+        return {
+            'total_users': self.total_users,
+            'total_videos': self.total_videos,
+            'active_today': self.active_since(active_since)
+        }
+
+    def top_user_ids(self, limit):
+        return sorted(self.top, key=self.top.get, reverse=True)[:limit]
+
+
+class JsonUserBackend:
+    """Whole database in one JSON file - fine for tiny deployments only"""
 
-# User Database Manager
-class UserDatabase:
     def __init__(self, db_file):
         self.db_file = db_file
         self.data = self.load_db()
+        self.aggregates = UserAggregates.from_users(self.data.values())
     
     def load_db(self):
         """Load user database from file"""
@@ -70,23 +232,646 @@ class UserDatabase:
             try:
                 with open(self.db_file, 'r', encoding='utf-8') as f:
                     return json.load(f)
-            except:
+            except (OSError, ValueError) as e:
+                # Buzilgan faylni ustiga yozmaymiz - qo'lda tiklash uchun saqlanadi
+                corrupt_file = f"{self.db_file}.corrupt-{int(time.time())}"
+                logger.error(f"❌ User database {self.db_file} unreadable ({e}), moved to {corrupt_file}")
+                os.replace(self.db_file, corrupt_file)
                 return {}
         return {}
     
     def save_db(self):
         """Save database to file"""
         try:
-            with open(self.db_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            write_file_atomic(self.db_file, json.dumps(self.data, ensure_ascii=False, indent=2))
         except Exception as e:
             logger.error(f"Error saving database: {e}")
     
+    def get(self, user_id):
+        return self.data.get(str(user_id))
+    
+    def insert(self, record):
+        self.data[str(record['user_id'])] = record
+        self.aggregates.add_user(record)
+        self.save_db()
+    
+    def record_video(self, user_id, now, file_id=None):
+        user = self.data.get(str(user_id))
+        if user is None:
+            return False
+        if file_id:
+            user['last_video_file_id'] = file_id
+        user['last_video_time'] = now
+        user['videos_created'] += 1
+        user['total_requests'] += 1
+        self.aggregates.record_video(user['user_id'], now, user['videos_created'])
+        self.save_db()
+        return True
+    
+    def stats(self, active_since):
+        return self.aggregates.stats(active_since)
+    
+    def top_users(self, limit):
+        return [self.data[str(user_id)] for user_id in self.aggregates.top_user_ids(limit)]
+
+
+class JournaledUserBackend(JsonUserBackend):
+    """
+    In-memory users backed by a snapshot file plus an append-only journal.
+    Each event appends one small record (fsync batched every fsync_interval
+    seconds); the compactor periodically writes an atomic snapshot and
+    starts a fresh journal. Startup replays snapshot + journal tail.
+    """
+
+    def __init__(self, db_file, journal_file=None, fsync_interval=1.0, compact_records=10000):
+        self.journal_file = journal_file or db_file + '.journal'
+        self.fsync_interval = fsync_interval
+        self.compact_records = compact_records
+        self._lock = threading.Lock()
+        self._journal = None
+        self._records = 0
+        self._dirty = False
+        super().__init__(db_file)
+        # Kompaktsiya orasida uzilgan bo'lsa eski jurnal ham qayta o'qiladi
+        replayed = self._replay(self.journal_file + '.old') + self._replay(self.journal_file)
+        self._records = replayed
+        if replayed:
+            self.aggregates = UserAggregates.from_users(self.data.values())
+        self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        if self._journal.tell() > 0:
+            # Kesilgan oxirgi yozuvdan keyingi yozuvlar alohida qatordan boshlanadi
+            self._journal.write('\n')
+        if replayed:
+            logger.info(f"📒 Replayed {replayed} journal records for {len(self.data)} users")
+
+    def _replay(self, path):
+        if not os.path.exists(path):
+            return 0
+        applied = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Oxirgi yozuv crash paytida kesilgan bo'lishi mumkin
+                    logger.warning(f"⚠️ Skipping torn journal record in {path}")
+                    continue
+                self._apply(entry)
+                applied += 1
+        return applied
+
+    def _apply(self, entry):
+        # Yozuvlar mutlaq qiymatlarni saqlaydi - qayta o'qish idempotent
+        if entry['op'] == 'add':
+            self.data.setdefault(str(entry['user']['user_id']), entry['user'])
+        elif entry['op'] == 'video':
+            user = self.data.get(str(entry['user_id']))
+            if user is not None:
+                user.update(entry['fields'])
+
+    def _append(self, entry):
+        # Chaqiruvchi self._lock ni ushlab turadi: xotira va jurnal birga o'zgaradi
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._journal.flush()
+        self._records += 1
+        self._dirty = True
+
+    def save_db(self):
+        pass  # Holat jurnal va snapshot orqali saqlanadi
+
+    def insert(self, record):
+        with self._lock:
+            self.data[str(record['user_id'])] = record
+            self.aggregates.add_user(record)
+            self._append({'op': 'add', 'user': record})
+
+    def record_video(self, user_id, now, file_id=None):
+        with self._lock:
+            user = self.data.get(str(user_id))
+            if user is None:
+                return False
+            fields = {
+                'last_video_time': now,
+                'videos_created': user['videos_created'] + 1,
+                'total_requests': user['total_requests'] + 1
+            }
+            if file_id:
+                fields['last_video_file_id'] = file_id
+            user.update(fields)
+            self.aggregates.record_video(user['user_id'], now, fields['videos_created'])
+            self._append({'op': 'video', 'user_id': user_id, 'fields': fields})
+        return True
+
+    def sync(self):
+        """fsync the journal if anything was appended since the last call"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            journal = self._journal
+        os.fsync(journal.fileno())
+
+    def compact(self):
+        """Write an atomic snapshot and start a fresh journal"""
+        with self._lock:
+            if self._records == 0:
+                return 0
+            snapshot = {user_id: dict(user) for user_id, user in self.data.items()}
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+            os.replace(self.journal_file, self.journal_file + '.old')
+            self._journal = open(self.journal_file, 'a', encoding='utf-8')
+            records = self._records
+            self._records = 0
+            self._dirty = False
+        write_file_atomic(self.db_file, json.dumps(snapshot, ensure_ascii=False))
+        os.remove(self.journal_file + '.old')
+        return records
+
+    async def run_compactor(self):
+        last_compaction = time.monotonic()
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            try:
+                await asyncio.to_thread(self.sync)
+                if self._records >= self.compact_records or (
+                    self._records and time.monotonic() - last_compaction > 3600
+                ):
+                    records = await asyncio.to_thread(self.compact)
+                    last_compaction = time.monotonic()
+                    logger.info(f"🧹 User journal compacted: {records} records folded into snapshot")
+            except Exception as e:
+                logger.error(f"User journal maintenance error: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._journal and not self._journal.closed:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+
+
+class SqliteUserBackend:
+    """
+    One row per user (SQLite, WAL). Every write touches a single row and
+    keeps the totals and the hourly active-user buckets current in the same
+    transaction, so statistics read a handful of rows: whole hours come from
+    the buckets, only the boundary hour is counted from the index.
+    """
+
+    BUCKET_SECONDS = 3600
+
+    FIELDS = ('user_id', 'username', 'first_name', 'videos_created', 'last_video_time',
+              'join_date', 'total_requests', 'last_video_file_id')
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # Har bir jarayon o'z ulanishiga ega bo'ladi (fork'dan keyin ham)
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                " user_id INTEGER PRIMARY KEY,"
+                " username TEXT,"
+                " first_name TEXT,"
+                " videos_created INTEGER NOT NULL DEFAULT 0,"
+                " last_video_time REAL NOT NULL DEFAULT 0,"
+                " join_date REAL NOT NULL,"
+                " total_requests INTEGER NOT NULL DEFAULT 0,"
+                " last_video_file_id TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_video ON users(last_video_time)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_users_videos ON users(videos_created)")
+            # Umumiy sonlar har bir yozuv bilan bir tranzaksiyada yangilanadi
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_totals ("
+                " id INTEGER PRIMARY KEY CHECK (id = 1),"
+                " total_users INTEGER NOT NULL,"
+                " total_videos INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO user_totals (id, total_users, total_videos)"
+                " SELECT 1, COUNT(*), COALESCE(SUM(videos_created), 0) FROM users"
+            )
+            conn.commit()
+            # Soatlik bucket'lar: oxirgi video vaqti shu soatga tushgan userlar soni.
+            # Jadval yangi bo'lsa bir marta mavjud userlardan to'ldiriladi
+            conn.execute("BEGIN IMMEDIATE")
+            if not conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'active_buckets'"
+            ).fetchone():
+                conn.execute(
+                    "CREATE TABLE active_buckets ("
+                    " bucket INTEGER PRIMARY KEY,"
+                    " users INTEGER NOT NULL)"
+                )
+                conn.execute(
+                    "INSERT INTO active_buckets (bucket, users)"
+                    " SELECT CAST(last_video_time / ? AS INTEGER), COUNT(*) FROM users"
+                    " WHERE last_video_time > 0 GROUP BY 1",
+                    (self.BUCKET_SECONDS,)
+                )
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _move_bucket(self, conn, timestamp, delta):
+        if not timestamp:
+            return
+        bucket = int(timestamp // self.BUCKET_SECONDS)
+        conn.execute(
+            "INSERT INTO active_buckets (bucket, users) VALUES (?, ?)"
+            " ON CONFLICT(bucket) DO UPDATE SET users = users + excluded.users",
+            (bucket, delta)
+        )
+        if delta < 0:
+            conn.execute("DELETE FROM active_buckets WHERE bucket = ? AND users <= 0", (bucket,))
+
+    def get(self, user_id):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT * FROM users WHERE user_id = ?", (int(user_id),)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def insert(self, record):
+        self.insert_many([record])
+
+    def insert_many(self, records):
+        sql = (
+            f"INSERT OR IGNORE INTO users ({', '.join(self.FIELDS)}) "
+            f"VALUES ({', '.join('?' for _ in self.FIELDS)})"
+        )
+        inserted = videos = 0
+        with self._lock:
+            conn = self._connection()
+            for record in records:
+                if conn.execute(sql, tuple(record.get(field) for field in self.FIELDS)).rowcount:
+                    inserted += 1
+                    videos += record.get('videos_created') or 0
+                    self._move_bucket(conn, record.get('last_video_time'), 1)
+            conn.execute(
+                "UPDATE user_totals SET total_users = total_users + ?, total_videos = total_videos + ?",
+                (inserted, videos)
+            )
+            conn.commit()
+
+    def record_video(self, user_id, now, file_id=None):
+        with self._lock:
+            conn = self._connection()
+            # Boshqa worker jarayonlari bilan: eski vaqtni o'qish va yangilash bitta tranzaksiyada
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT last_video_time FROM users WHERE user_id = ?", (int(user_id),)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE users SET last_video_time = ?, videos_created = videos_created + 1,"
+                        " total_requests = total_requests + 1,"
+                        " last_video_file_id = COALESCE(?, last_video_file_id) WHERE user_id = ?",
+                        (now, file_id, int(user_id))
+                    )
+                    conn.execute("UPDATE user_totals SET total_videos = total_videos + 1")
+                    self._move_bucket(conn, row[0], -1)
+                    self._move_bucket(conn, now, 1)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return row is not None
+
+    def count(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def stats(self, active_since):
+        with self._lock:
+            conn = self._connection()
+            total_users, total_videos = conn.execute(
+                "SELECT total_users, total_videos FROM user_totals"
+            ).fetchone()
+            # To'liq soatlar bucket'lardan, chegaradagi soat indeks orqali aniq sanaladi
+            first_bucket = int(active_since // self.BUCKET_SECONDS)
+            whole_hours = conn.execute(
+                "SELECT COALESCE(SUM(users), 0) FROM active_buckets WHERE bucket > ?", (first_bucket,)
+            ).fetchone()[0]
+            boundary_hour = conn.execute(
+                "SELECT COUNT(*) FROM users WHERE last_video_time > ? AND last_video_time < ?",
+                (active_since, (first_bucket + 1) * self.BUCKET_SECONDS)
+            ).fetchone()[0]
+            active_today = whole_hours + boundary_hour
+        return {
+            'total_users': total_users,
+            'total_videos': total_videos,
+            'active_today': active_today
+        }
+
+    def top_users(self, limit):
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT * FROM users ORDER BY videos_created DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def migrate_json_users(json_file, backend):
+    """One-shot import of the legacy JSON database into an empty SQLite backend"""
+    if not os.path.exists(json_file) or backend.count() > 0:
+        return 0
+    legacy = JsonUserBackend(json_file)
+    records = []
+    for user_id, user in legacy.data.items():
+        record = {
+            'user_id': int(user.get('user_id', user_id)),
+            'videos_created': 0,
+            'last_video_time': 0,
+            'join_date': time.time(),
+            'total_requests': 0
+        }
+        record.update({field: user[field] for field in SqliteUserBackend.FIELDS if field in user})
+        records.append(record)
+    backend.insert_many(records)
+    # Eski faylni qayta import qilinmasligi uchun nomini o'zgartiramiz
+    os.replace(json_file, json_file + '.migrated')
+    logger.info(f"📦 Migrated {len(records)} users from {json_file} to SQLite")
+    return len(records)
+
+
+class MemoryCooldownStore:
+    """In-process cooldown reservations - single replica or tests only"""
+
+    def __init__(self, cooldown, hold):
+        self.cooldown = cooldown
+        self.hold = hold
+        self._reserved = {}  # user_id -> (token, expires_at, pending)
+        self._lock = threading.Lock()
+
+    async def reserve(self, user_id):
+        """
+        Atomically take a pending reservation for the user's next video.
+        Returns (status, time_left, token) with status one of
+        RESERVED / IN_PROGRESS / COOLDOWN.
+        """
+        now = time.time()
+        with self._lock:
+            current = self._reserved.get(user_id)
+            if current and current[1] > now:
+                return (IN_PROGRESS if current[2] else COOLDOWN), current[1] - now, None
+            self._reserved[user_id] = (now, now + self.hold, True)
+        return RESERVED, 0, now
+
+    async def commit(self, user_id, token):
+        """Turn a pending reservation into a full cooldown starting now"""
+        with self._lock:
+            current = self._reserved.get(user_id)
+            if current and current[0] == token and current[2]:
+                self._reserved[user_id] = (token, time.time() + self.cooldown, False)
+
+    async def cancel(self, user_id, token):
+        """Refund a pending reservation; committed cooldowns are never refunded"""
+        with self._lock:
+            current = self._reserved.get(user_id)
+            if current and current[0] == token and current[2]:
+                del self._reserved[user_id]
+
+    async def take_over(self, user_id, older_than):
+        """
+        Replace a pending reservation taken before older_than (its holder
+        crashed) with a fresh one; otherwise behave like reserve().
+        """
+        now = time.time()
+        with self._lock:
+            current = self._reserved.get(user_id)
+            if current and current[2] and current[1] > now and current[0] < older_than:
+                self._reserved[user_id] = (now, now + self.hold, True)
+                return RESERVED, 0, now
+        return await self.reserve(user_id)
+
+    async def status(self, user_id):
+        """(in_progress, time_left) for display"""
+        current = self._reserved.get(user_id)
+        if not current or current[1] <= time.time():
+            return False, 0
+        return current[2], current[1] - time.time()
+
+    async def close(self):
+        pass
+
+
+class SqliteCooldownStore:
+    """
+    Cooldown reservations in a SQLite file (WAL). The check-and-reserve is a
+    single conditional upsert, so replicas sharing the file never double-grant.
+    """
+
+    def __init__(self, db_file, cooldown, hold):
+        self.db_file = db_file
+        self.cooldown = cooldown
+        self.hold = hold
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # Har bir jarayon o'z ulanishiga ega bo'ladi (fork'dan keyin ham)
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Replikalar bir vaqtda ishga tushsa sxema o'zgarishi ketma-ket bajariladi
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cooldowns ("
+                " user_id INTEGER PRIMARY KEY,"
+                " reserved_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL DEFAULT 0,"
+                " pending INTEGER NOT NULL DEFAULT 0)"
+            )
+            try:
+                # Eski jadval: faqat reserved_at bor edi
+                conn.execute("ALTER TABLE cooldowns ADD COLUMN expires_at REAL NOT NULL DEFAULT 0")
+                conn.execute("ALTER TABLE cooldowns ADD COLUMN pending INTEGER NOT NULL DEFAULT 0")
+                conn.execute("UPDATE cooldowns SET expires_at = reserved_at + ?", (self.cooldown,))
+            except sqlite3.OperationalError:
+                pass  # Ustunlar allaqachon mavjud
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _reserve(self, user_id):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            granted = conn.execute(
+                "INSERT INTO cooldowns (user_id, reserved_at, expires_at, pending) VALUES (?, ?, ?, 1)"
+                " ON CONFLICT(user_id) DO UPDATE SET reserved_at = excluded.reserved_at,"
+                " expires_at = excluded.expires_at, pending = 1"
+                " WHERE cooldowns.expires_at <= ?",
+                (user_id, now, now + self.hold, now)
+            ).rowcount
+            conn.commit()
+        if granted:
+            return RESERVED, 0, now
+        in_progress, time_left = self._status(user_id)
+        return (IN_PROGRESS if in_progress else COOLDOWN), time_left, None
+
+    def _take_over(self, user_id, older_than):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            taken = conn.execute(
+                "UPDATE cooldowns SET reserved_at = ?, expires_at = ?"
+                " WHERE user_id = ? AND pending = 1 AND expires_at > ? AND reserved_at < ?",
+                (now, now + self.hold, user_id, now, older_than)
+            ).rowcount
+            conn.commit()
+        if taken:
+            return RESERVED, 0, now
+        return self._reserve(user_id)
+
+    def _commit(self, user_id, token):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "UPDATE cooldowns SET expires_at = ?, pending = 0"
+                " WHERE user_id = ? AND reserved_at = ? AND pending = 1",
+                (time.time() + self.cooldown, user_id, token)
+            )
+            conn.commit()
+
+    def _cancel(self, user_id, token):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "DELETE FROM cooldowns WHERE user_id = ? AND reserved_at = ? AND pending = 1",
+                (user_id, token)
+            )
+            conn.commit()
+
+    def _status(self, user_id):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT expires_at, pending FROM cooldowns WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        now = time.time()
+        if not row or row[0] <= now:
+            return False, 0
+        return bool(row[1]), row[0] - now
+
+    async def reserve(self, user_id):
+        return await asyncio.to_thread(self._reserve, user_id)
+
+    async def take_over(self, user_id, older_than):
+        return await asyncio.to_thread(self._take_over, user_id, older_than)
+
+    async def commit(self, user_id, token):
+        await asyncio.to_thread(self._commit, user_id, token)
+
+    async def cancel(self, user_id, token):
+        await asyncio.to_thread(self._cancel, user_id, token)
+
+    async def status(self, user_id):
+        return await asyncio.to_thread(self._status, user_id)
+
+    async def close(self):
+        pass
+
+
+class RedisCooldownStore:
+    """
+    Cooldown reservations shared through Redis: SET NX PX grants a pending
+    slot atomically; commit/cancel are compare-and-set scripts on the token.
+    Values are "pending:<token>" or "done:<token>".
+    """
+
+    # Faqat o'zimiz qo'ygan rezervatsiyani o'zgartiramiz
+    COMMIT_SCRIPT = (
+        "if redis.call('GET', KEYS[1]) == 'pending:' .. ARGV[1] then "
+        "return redis.call('SET', KEYS[1], 'done:' .. ARGV[1], 'PX', ARGV[2]) end return 0"
+    )
+    CANCEL_SCRIPT = (
+        "if redis.call('GET', KEYS[1]) == 'pending:' .. ARGV[1] then "
+        "return redis.call('DEL', KEYS[1]) end return 0"
+    )
+    # Token - reserve() vaqti; faqat older_than dan oldingi pending rezervatsiya olinadi
+    TAKE_OVER_SCRIPT = (
+        "local value = redis.call('GET', KEYS[1]) "
+        "if value and string.sub(value, 1, 8) == 'pending:' "
+        "and tonumber(string.sub(value, 9)) < tonumber(ARGV[3]) then "
+        "redis.call('SET', KEYS[1], 'pending:' .. ARGV[1], 'PX', ARGV[2]) return 1 end return 0"
+    )
+
+    def __init__(self, url, cooldown, hold, prefix='jonlantir:cooldown:'):
+        if aioredis is None:
+            raise RuntimeError("COOLDOWN_BACKEND=redis requires the 'redis' package")
+        self.client = aioredis.from_url(url, decode_responses=True)
+        self.cooldown = cooldown
+        self.hold = hold
+        self.prefix = prefix
+
+    async def reserve(self, user_id):
+        token = f"{time.time():.6f}"
+        granted = await self.client.set(
+            f"{self.prefix}{user_id}", f"pending:{token}", nx=True, px=int(self.hold * 1000)
+        )
+        if granted:
+            return RESERVED, 0, token
+        in_progress, time_left = await self.status(user_id)
+        return (IN_PROGRESS if in_progress else COOLDOWN), time_left, None
+
+    async def take_over(self, user_id, older_than):
+        token = f"{time.time():.6f}"
+        taken = await self.client.eval(
+            self.TAKE_OVER_SCRIPT, 1, f"{self.prefix}{user_id}", token, int(self.hold * 1000), older_than
+        )
+        if taken:
+            return RESERVED, 0, token
+        return await self.reserve(user_id)
+
+    async def commit(self, user_id, token):
+        await self.client.eval(
+            self.COMMIT_SCRIPT, 1, f"{self.prefix}{user_id}", token, int(self.cooldown * 1000)
+        )
+
+    async def cancel(self, user_id, token):
+        await self.client.eval(self.CANCEL_SCRIPT, 1, f"{self.prefix}{user_id}", token)
+
+    async def status(self, user_id):
+        key = f"{self.prefix}{user_id}"
+        async with self.client.pipeline(transaction=True) as pipe:
+            value, ttl = await pipe.get(key).pttl(key).execute()
+        if not value or not ttl or ttl <= 0:
+            return False, 0
+        return value.startswith('pending:'), ttl / 1000
+
+    async def close(self):
+        await self.client.close()
+
+
+# User Database Manager
+class UserDatabase:
+    def __init__(self, backend, cooldowns=None):
+        self.backend = backend
+        self.cooldowns = cooldowns or MemoryCooldownStore(VIDEO_COOLDOWN_SECONDS, RESERVATION_HOLD_SECONDS)
+    
     def add_user(self, user_id, username, first_name):
         """Add new user to database"""
-        user_id_str = str(user_id)
-        if user_id_str not in self.data:
-            self.data[user_id_str] = {
+        if self.backend.get(user_id) is None:
+            self.backend.insert({
                 'user_id': user_id,
                 'username': username,
                 'first_name': first_name,
@@ -94,8 +879,7 @@ class UserDatabase:
                 'last_video_time': 0,
                 'join_date': time.time(),
                 'total_requests': 0
-            }
-            self.save_db()
+            })
             logger.info(f"New user added: {user_id} - {username}")
     
     def can_create_video(self, user_id):
@@ -104,11 +888,11 @@ class UserDatabase:
         if user_id in ADMIN_IDS:
             return True, 0
         
-        user_id_str = str(user_id)
-        if user_id_str not in self.data:
+        user = self.backend.get(user_id)
+        if user is None:
             return True, 0
         
-        last_time = self.data[user_id_str].get('last_video_time', 0)
+        last_time = user.get('last_video_time', 0)
         time_passed = time.time() - last_time
         
         if time_passed >= VIDEO_COOLDOWN_SECONDS:
@@ -117,96 +901,518 @@ class UserDatabase:
             time_left = VIDEO_COOLDOWN_SECONDS - time_passed
             return False, time_left
     
-    def record_video_creation(self, user_id):
+    async def reserve_video(self, user_id):
+        """
+        Atomic check-and-reserve of the next video slot, shared by all replicas.
+        Returns (status, time_left, token). The pending reservation is held
+        while the job runs: finish_reservation() commits it on delivery and
+        refunds it otherwise.
+        """
+        if user_id in ADMIN_IDS:
+            return RESERVED, 0, None
+        
+        can_create, time_left = self.can_create_video(user_id)
+        if not can_create:
+            return COOLDOWN, time_left, None
+        return await self.cooldowns.reserve(user_id)
+    
+    async def take_over_reservation(self, user_id):
+        """
+        reserve_video() for an update replayed after its worker crashed:
+        the crashed worker's pending reservation is taken over instead of
+        answering "already in progress".
+        """
+        if user_id in ADMIN_IDS:
+            return RESERVED, 0, None
+        
+        can_create, time_left = self.can_create_video(user_id)
+        if not can_create:
+            return COOLDOWN, time_left, None
+        return await self.cooldowns.take_over(user_id, PROCESS_STARTED_AT)
+    
+    async def finish_reservation(self, user_id, token, delivered):
+        if token is None:
+            return
+        try:
+            if delivered:
+                await self.cooldowns.commit(user_id, token)
+            else:
+                await self.cooldowns.cancel(user_id, token)
+        except Exception as e:
+            logger.error(f"Cooldown reservation error for user {user_id}: {e}")
+    
+    async def cooldown_left(self, user_id):
+        """(can_create, time_left) taking the shared cooldown store into account"""
+        can_create, time_left = self.can_create_video(user_id)
+        if not can_create or user_id in ADMIN_IDS:
+            return can_create, time_left
+        in_progress, time_left = await self.cooldowns.status(user_id)
+        if in_progress:
+            # Video tayyor bo'lgach to'liq cheklov boshlanadi
+            return False, VIDEO_COOLDOWN_SECONDS
+        return time_left <= 0, time_left
+    
+    def record_video_creation(self, user_id, file_id=None):
         """Record that user created a video"""
-        user_id_str = str(user_id)
-        if user_id_str in self.data:
-            self.data[user_id_str]['last_video_time'] = time.time()
-            self.data[user_id_str]['videos_created'] += 1
-            self.data[user_id_str]['total_requests'] += 1
-            self.save_db()
+        self.backend.record_video(user_id, time.time(), file_id)
     
     def get_user_stats(self, user_id):
         """Get user statistics"""
-        user_id_str = str(user_id)
-        if user_id_str in self.data:
-            return self.data[user_id_str]
-        return None
+        return self.backend.get(user_id)
     
     def get_all_stats(self):
         """Get overall statistics"""
-        total_users = len(self.data)
-        total_videos = sum(user['videos_created'] for user in self.data.values())
-        active_today = sum(1 for user in self.data.values() 
-                          if time.time() - user.get('last_video_time', 0) < 86400)
-        return {
-            'total_users': total_users,
-            'total_videos': total_videos,
-            'active_today': active_today
+        return self.backend.stats(time.time() - 86400)
+    
+    def get_top_users(self, limit=10):
+        """Most active users by videos created"""
+        return self.backend.top_users(limit)
+
+
+def create_user_backend():
+    if USER_DB_BACKEND == 'json':
+        return JsonUserBackend(USER_DB_FILE)
+    if USER_DB_BACKEND == 'journal':
+        return JournaledUserBackend(USER_DB_FILE)
+    return SqliteUserBackend(USER_SQLITE_FILE)
+
+
+def create_cooldown_store():
+    if COOLDOWN_BACKEND == 'redis':
+        return RedisCooldownStore(REDIS_URL, VIDEO_COOLDOWN_SECONDS, RESERVATION_HOLD_SECONDS)
+    if COOLDOWN_BACKEND == 'memory':
+        return MemoryCooldownStore(VIDEO_COOLDOWN_SECONDS, RESERVATION_HOLD_SECONDS)
+    return SqliteCooldownStore(COOLDOWN_DB_FILE, VIDEO_COOLDOWN_SECONDS, RESERVATION_HOLD_SECONDS)
+
+
+# Baza main() (yoki worker) ichida ochiladi - spawn qilingan jarayonlar modulni qayta
+# import qiladi va import paytida fayllarga tegmasligi kerak
+user_db = UserDatabase(None)
+
+
+def init_storage(migrate=False):
+    """Open the user database and cooldown store of this process (migration only in the parent)"""
+    user_db.backend = create_user_backend()
+    user_db.cooldowns = create_cooldown_store()
+    if migrate and isinstance(user_db.backend, SqliteUserBackend):
+        migrate_json_users(USER_DB_FILE, user_db.backend)
+
+
+class GoogleCredentialManager:
+    """
+    Process-wide service account credentials.
+    Loads the key once, keeps the OAuth token fresh in the background and
+    hands out warm API clients (Vision + Vertex token).
+    """
+
+    SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+    def __init__(self, service_account_file, refresh_margin=300):
+        self.service_account_file = service_account_file
+        self.refresh_margin = refresh_margin
+        self._credentials = None
+        self._auth_request = None
+        self._vision_client = None
+        self._lock = threading.Lock()
+        self._refresh_future = None
+        self._refresh_task = None
+
+    def _load(self):
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = service_account.Credentials.from_service_account_file(
+                    self.service_account_file,
+                    scopes=self.SCOPES
+                )
+            return self._credentials
+
+    def _seconds_left(self):
+        credentials = self._credentials
+        if not credentials or not credentials.token or not credentials.expiry:
+            return 0
+        return (credentials.expiry - datetime.utcnow()).total_seconds()
+
+    def _refresh_sync(self, margin):
+        """Blocking refresh - always run off the event loop"""
+        credentials = self._load()
+        with self._lock:
+            # Boshqa thread allaqachon yangilagan bo'lishi mumkin
+            if self._seconds_left() > margin:
+                return credentials.token
+
+            if self._auth_request is None:
+                session = requests.Session()
+                session.trust_env = False
+                self._auth_request = Request(session)
+
+            credentials.refresh(self._auth_request)
+            logger.info(f"🔑 Access token refreshed, valid for {int(self._seconds_left())}s")
+            return credentials.token
+
+    async def _refresh(self, margin):
+        # Single-flight: bir vaqtda faqat bitta refresh
+        if self._refresh_future is None or self._refresh_future.done():
+            self._refresh_future = asyncio.ensure_future(
+                asyncio.to_thread(self._refresh_sync, margin)
+            )
+        return await asyncio.shield(self._refresh_future)
+
+    async def get_token(self):
+        """Return a valid access token, refreshing only if it is about to expire"""
+        if self._seconds_left() > 60:
+            return self._credentials.token
+        return await self._refresh(60)
+
+    def vision_client(self):
+        """Shared Vision client built once with the cached credentials"""
+        credentials = self._load()
+        with self._lock:
+            if self._vision_client is None:
+                self._vision_client = vision.ImageAnnotatorClient(credentials=credentials)
+            return self._vision_client
+
+    def start(self):
+        """Start proactive background token refresh"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            delay = max(5, self._seconds_left() - self.refresh_margin)
+            await asyncio.sleep(delay)
+            try:
+                await self._refresh(self.refresh_margin)
+            except Exception as e:
+                logger.warning(f"⚠️ Background token refresh failed (will retry): {e}")
+                await asyncio.sleep(30)
+
+
+# Bitta credential manager butun jarayon uchun
+google_credentials = GoogleCredentialManager(GOOGLE_SERVICE_ACCOUNT_FILE)
+
+
+def photo_properties(image_bytes, thumb_side=128):
+    """
+    Local replacement for Vision image_properties: dominant colours by
+    quantization plus photo-age signals computed on a small thumbnail
+    (saturation histogram, grayscale/sepia detection, contrast spread).
+    Deterministic for a given image.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft('RGB', (thumb_side * 2, thumb_side * 2))  # JPEG: to'liq decode qilinmaydi
+    thumb = img.convert('RGB')
+    thumb.thumbnail((thumb_side, thumb_side), Image.Resampling.BILINEAR)
+    
+    # Dominant ranglar - median cut kvantlash (Vision'dagi kabi 3 ta)
+    quantized = thumb.quantize(colors=3, method=Image.Quantize.MEDIANCUT)
+    palette = quantized.getpalette()
+    total = thumb.width * thumb.height
+    dominant_colors = [
+        {
+            'r': palette[index * 3],
+            'g': palette[index * 3 + 1],
+            'b': palette[index * 3 + 2],
+            'score': count / total
         }
+        for count, index in sorted(quantized.getcolors(), reverse=True)
+    ]
+    
+    # Avvalgi qoida: dominant ranglar kulrangga yaqin bo'lsa - eski rasm
+    avg_color_spread = sum(
+        abs(c['r'] - c['g']) + abs(c['g'] - c['b']) for c in dominant_colors
+    ) / len(dominant_colors) / 3
+    properties = {
+        'dominant_colors': dominant_colors,
+        'is_old_photo': avg_color_spread < 20,
+        'is_low_quality': False
+    }
+    if np is None:
+        return properties
+    
+    pixels = np.asarray(thumb, dtype=np.float32).reshape(-1, 3)
+    high = pixels.max(axis=1)
+    low = pixels.min(axis=1)
+    saturation = np.divide(high - low, high, out=np.zeros_like(high), where=high > 0)
+    saturation_histogram = np.histogram(saturation, bins=10, range=(0.0, 1.0))[0] / len(saturation)
+    mean_saturation = float(saturation.mean())
+    
+    # Kulrang: deyarli barcha piksellar rangsiz
+    grayscale = float(saturation_histogram[0] + saturation_histogram[1]) > 0.9
+    
+    # Sepia: butun rasm bitta iliq tonda (R >= G >= B, tus 15-50°) va to'yinganligi
+    # past hamda bir xil. Iliq zamonaviy rasmda (teri, yog'och, chiroq) tus o'xshash
+    # bo'lsa ham to'yinganlik piksellar bo'yicha keng tarqalgan bo'ladi
+    red, green, blue = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+    warm = (red >= green) & (green >= blue)
+    tinted = (high - low) > 8  # deyarli kulrang piksellarda tus aniq emas
+    hue = np.divide(60 * (green - blue), red - blue, out=np.zeros_like(red), where=red > blue)
+    one_tone = warm & (hue >= 15) & (hue <= 50)
+    sepia = (
+        not grayscale
+        and mean_saturation < 0.35
+        and float(warm.mean()) > 0.9
+        and tinted.any()
+        and float(one_tone[tinted].mean()) > 0.9
+        and float(saturation[tinted].std()) < 0.08
+    )
+    
+    # Kontrast: yorqinlikning 5-95 persentil oralig'i (xira rasm - tor)
+    luma = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    p5, p95 = np.percentile(luma, [5, 95])
+    contrast_spread = float(p95 - p5)
+    
+    properties.update({
+        # Dominant rang qoidasi iliq zamonaviy rasmlarni ham ushlaydi - faqat NumPy'siz qoladi
+        'is_old_photo': grayscale or sepia,
+        'is_low_quality': contrast_spread < 80,
+        'mean_saturation': round(mean_saturation, 4),
+        'saturation_histogram': [round(float(v), 4) for v in saturation_histogram],
+        'grayscale': grayscale,
+        'sepia': sepia,
+        'contrast_spread': round(contrast_spread, 1)
+    })
+    return properties
+
+
+class VisionStats:
+    """
+    Vision cost per photo class for the staged analyzer, measured against
+    one combined faces+labels request per photo. Negative "avoided" values
+    mean staging cost extra (a second RPC for photos that do have faces).
+    """
+    
+    BASELINE_FEATURES = 2
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.classes = {}
+    
+    def record(self, photo_class, rpcs, bytes_sent, features, image_bytes):
+        with self.lock:
+            counters = self.classes.setdefault(photo_class, {
+                'photos': 0, 'rpcs': 0, 'bytes': 0, 'features': 0, 'baseline_bytes': 0
+            })
+            counters['photos'] += 1
+            counters['rpcs'] += rpcs
+            counters['bytes'] += bytes_sent
+            counters['features'] += features
+            counters['baseline_bytes'] += image_bytes
+    
+    def stats(self):
+        with self.lock:
+            return {
+                photo_class: {
+                    **counters,
+                    'rpcs_avoided': counters['photos'] - counters['rpcs'],
+                    'bytes_avoided': counters['baseline_bytes'] - counters['bytes'],
+                    'features_avoided': counters['photos'] * self.BASELINE_FEATURES - counters['features']
+                }
+                for photo_class, counters in self.classes.items()
+            }
+
+
+# Bosqichma-bosqich tahlil: avval yuzlar, label faqat yuz topilsa
+VISION_STAGED = os.getenv('VISION_STAGED', 'true').lower() == 'true'
+vision_stats = VisionStats()
+
+
+class VisionBatcher:
+    """
+    Micro-batches Vision requests from concurrent users into one
+    batch_annotate_images call of up to max_batch images. Requests are
+    collected on the event loop; each batch is a single to_thread() RPC with
+    a deadline. Unless the smoothed inter-arrival gap says at least two more
+    requests will land within the window, a request is sent at once together
+    with whatever is already queued; under load requests wait at most
+    `window` seconds for companions. A batch that fails or times out is
+    retried as single-image calls.
+    """
+    
+    def __init__(self, client_factory, window, max_batch=16, max_bytes=8 * 1024 * 1024, max_in_flight=4, timeout=30):
+        self.client_factory = client_factory
+        self.window = window
+        self.max_batch = max_batch
+        self.max_bytes = max_bytes
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.pending = []  # (request, future) - event loop'da
+        self.pending_bytes = 0
+        self.flush_timer = None
+        self.in_flight = None
+        self.closed = False
+        self.last_arrival = time.monotonic()
+        self.gap = window  # Kelishlar orasidagi silliqlangan interval (EWMA), namunalar window bilan cheklangan
+        self.batches = 0
+        self.requests = 0
+        self.fallbacks = 0
+    
+    def _call(self, requests):
+        """Blocking RPC - runs in a thread; the deadline frees the thread too"""
+        return self.client_factory().batch_annotate_images(requests=requests, timeout=self.timeout).responses
+    
+    async def _call_async(self, requests):
+        # gRPC deadline'dan keyin ham javob bo'lmasa - loop tomonda ham kutish to'xtatiladi
+        return await asyncio.wait_for(asyncio.to_thread(self._call, requests), self.timeout + 5)
+    
+    async def annotate(self, request):
+        """The AnnotateImageResponse for one AnnotateImageRequest"""
+        if self.window <= 0 or self.closed:
+            return (await self._call_async([request]))[0]
+        
+        # Bo'sh turgan vaqt o'rtachaga oyna uzunligidan ko'p qo'shilmaydi - aks holda uzoq
+        # tanaffusdan keyingi to'lqinda gap katta qolib, har so'rov alohida ketadi
+        now = time.monotonic()
+        self.gap = 0.8 * self.gap + 0.2 * min(now - self.last_arrival, self.window)
+        self.last_arrival = now
+        
+        size = len(request.image.content)
+        if self.pending and self.pending_bytes + size > self.max_bytes:
+            self._flush()  # So'rov hajmi chegarasi - navbatdagilar alohida batch
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((request, future))
+        self.pending_bytes += size
+        
+        # Sokin paytda kutilmaydi - bitta foydalanuvchi latency'si o'zgarmaydi
+        if len(self.pending) >= self.max_batch or 2 * self.gap > self.window:
+            self._flush()
+        elif self.flush_timer is None:
+            self.flush_timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+    
+    def _flush(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        batch, self.pending, self.pending_bytes = self.pending, [], 0
+        if batch:
+            spawn_background(self._send(batch))
+    
+    async def _send(self, batch):
+        if self.in_flight is None:
+            self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        try:
+            async with self.in_flight:
+                # Kutish paytida bekor qilingan so'rovlar yuborilmaydi
+                batch = [(request, future) for request, future in batch if not future.done()]
+                if not batch:
+                    return
+                requests = [request for request, _ in batch]
+                started = time.perf_counter()
+                try:
+                    results = await self._call_async(requests)
+                    self.batches += 1
+                    self.requests += len(batch)
+                    if len(batch) > 1:
+                        logger.info(f"⚡ Vision batch: {len(batch)} images, {(time.perf_counter() - started) * 1000:.0f} ms")
+                except Exception as e:
+                    if len(batch) == 1:
+                        results = [e]
+                    else:
+                        # Butun batch xato bersa har bir rasm alohida - bitta yomon batch hammani yiqitmaydi
+                        logger.warning(f"⚠️ Vision batch of {len(batch)} failed ({type(e).__name__}: {e}) - sending one by one")
+                        self.fallbacks += 1
+                        results = await asyncio.gather(
+                            *(self._call_async([request]) for request in requests), return_exceptions=True
+                        )
+                        results = [result if isinstance(result, BaseException) else result[0] for result in results]
+                for (_, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, BaseException):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            # Bekor qilingan _send (shutdown) kutayotganlarni osilib qoldirmaydi
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
+    
+    def shutdown(self):
+        """Stop batching; queued callers are cancelled, later calls go out one by one"""
+        self.closed = True
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        batch, self.pending, self.pending_bytes = self.pending, [], 0
+        for _, future in batch:
+            if not future.done():
+                future.cancel()
+    
+    def stats(self):
+        return {'batches': self.batches, 'requests': self.requests, 'fallbacks': self.fallbacks}
 
 
-# Initialize database
-user_db = UserDatabase(USER_DB_FILE)
+# Bir vaqtda kelgan rasmlar bitta Vision RPC'ga yig'iladi (0 = o'chirilgan)
+VISION_BATCH_WINDOW_MS = int(os.getenv('VISION_BATCH_WINDOW_MS', '100'))
+VISION_BATCH_SIZE = min(int(os.getenv('VISION_BATCH_SIZE', '16')), 16)  # API chegarasi: 16 rasm
+VISION_TIMEOUT_SECONDS = float(os.getenv('VISION_TIMEOUT_SECONDS', '30'))
 
 
 # Rasmni tahlil qilish va mos prompt yaratish uchun yordamchi funksiya
 class ImageAnalyzer:
-    def __init__(self, service_account_file):
-        self.service_account_file = service_account_file
+    def __init__(self, credentials, batcher):
+        self.credentials = credentials
+        self.batcher = batcher
         
-    def analyze_image(self, image_bytes):
-        """Rasmni CHUQUR tahlil qilish - odamlar, sifat, rang"""
-        try:
-            # Vision API client
-            credentials = service_account.Credentials.from_service_account_file(
-                self.service_account_file
-            )
-            client = vision.ImageAnnotatorClient(credentials=credentials)
-            
-            image = vision.Image(content=image_bytes)
-            
-            # 1. Face detection (yuzlar)
-            faces = client.face_detection(image=image).face_annotations
-            
-            # 2. Label detection (ob'ektlar, vaziyat)
-            labels = client.label_detection(image=image).label_annotations
-            
-            # 3. Image properties (ranglar, sifat)
-            props = client.image_properties(image=image).image_properties_annotation
-            
-            # 4. Safe search (rasm turi)
-            safe = client.safe_search_detection(image=image).safe_search_annotation
+    async def _annotate(self, image_bytes, features):
+        """Annotate one image via the shared batcher; raises on a per-image error"""
+        request = vision.AnnotateImageRequest(
+            image=vision.Image(content=image_bytes),
+            features=features
+        )
+        
+        started = time.perf_counter()
+        response = await self.batcher.annotate(request)
+        latency_ms = (time.perf_counter() - started) * 1000
+        
+        if response.error.message:
+            raise RuntimeError(response.error.message)
+        
+        names = ', '.join(feature.type_.name for feature in features)
+        logger.info(f"⚡ Vision: ({names}), {len(image_bytes)} bytes, {latency_ms:.0f} ms")
+        return response
+    
+    async def analyze_image(self, image_bytes):
+        """Rasmni CHUQUR tahlil qilish - odamlar, sifat, rang"""
+        try:
+            # 1. Face detection (yuzlar) - eng arzon va hal qiluvchi bosqich
+            face_feature = vision.Feature(type_=vision.Feature.Type.FACE_DETECTION)
+            # 2. Label detection (ob'ektlar, vaziyat) - maxResults faqat generate_uzbek_prompt o'qiydigan miqdorda
+            label_feature = vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION, max_results=15)
             
-            # Ranglarni tahlil qilish
-            dominant_colors = []
-            if props and props.dominant_colors:
-                for color in props.dominant_colors.colors[:3]:
-                    rgb = color.color
-                    dominant_colors.append({
-                        'r': rgb.red,
-                        'g': rgb.green,
-                        'b': rgb.blue,
-                        'score': color.score
-                    })
+            if VISION_STAGED:
+                # Yuz bo'lmasa generate_uzbek_prompt default prompt qaytaradi - label kerak emas
+                faces = (await self._annotate(image_bytes, [face_feature])).face_annotations
+                labels = (await self._annotate(image_bytes, [label_feature])).label_annotations if faces else []
+                rpcs = 2 if faces else 1
+                features = rpcs
+            else:
+                response = await self._annotate(image_bytes, [face_feature, label_feature])
+                faces = response.face_annotations
+                labels = response.label_annotations
+                rpcs, features = 1, 2
             
-            # Rasm eski/xira ekanligini aniqlash
-            is_old_photo = False
-            is_low_quality = False
+            vision_stats.record('faces' if faces else 'no_faces', rpcs, rpcs * len(image_bytes), features, len(image_bytes))
             
-            # Agar ranglar juda kam yoki kulrang bo'lsa - eski rasm
-            if dominant_colors:
-                avg_saturation = sum([abs(c['r'] - c['g']) + abs(c['g'] - c['b']) for c in dominant_colors]) / len(dominant_colors) / 3
-                if avg_saturation < 20:  # Juda past to'yinganlik = eski rasm
-                    is_old_photo = True
+            # Rang va eskilik signallari lokal hisoblanadi (image_properties RPC kerak emas)
+            properties = await asyncio.to_thread(photo_properties, image_bytes)
+            is_old_photo = properties['is_old_photo']
             
             analysis = {
                 'face_count': len(faces),
                 'faces': [],
                 'labels': [label.description.lower() for label in labels[:15]],
-                'is_old_photo': is_old_photo,
-                'is_low_quality': is_low_quality,
-                'dominant_colors': dominant_colors
+                **properties
             }
             
             # Har bir yuzni tahlil qilish
@@ -227,12 +1433,63 @@ class ImageAnalyzer:
             logger.error(f"Image analysis error: {e}")
             return None
     
-    def enhance_old_photo(self, image_bytes):
+    @staticmethod
+    def _enhance_chain(img):
+        """Original enhancer chain - used when NumPy is not available"""
+        img = ImageEnhance.Sharpness(img).enhance(2.0)  # 2x keskinroq
+        img = ImageEnhance.Contrast(img).enhance(1.5)  # 1.5x kontrast
+        img = ImageEnhance.Color(img).enhance(1.8)  # 1.8x rangli
+        img = ImageEnhance.Brightness(img).enhance(1.2)  # 1.2x yorug'roq
+        return img.filter(ImageFilter.SMOOTH)  # Shovqinni kamaytirish
+    
+    @staticmethod
+    def _blend(degenerate, image, factor):
+        """Image.blend(degenerate, image, factor > 1) on arrays: float32, clip to 0..255, truncate"""
+        out = np.float32(degenerate) + np.float32(factor) * (np.float32(image) - np.float32(degenerate))
+        np.clip(out, 0, 255, out=out)
+        return out.astype(np.uint8)
+    
+    @staticmethod
+    def _enhance_fused(img, strip_rows=64):
+        """
+        Same transform as _enhance_chain without the per-step full-size copies.
+        Every stage clips to 0..255 and truncates like Image.blend(), so the
+        output is identical to the chain: Contrast is a 256-entry table,
+        Color followed by Brightness a 256x256 table indexed by (L, value),
+        applied strip by strip in place.
+        """
+        blend = ImageAnalyzer._blend
+        smoothed = img.filter(ImageFilter.SMOOTH)
+        width, height = img.size
+        strips = [(0, y, width, min(y + strip_rows, height)) for y in range(0, height, strip_rows)]
+        
+        # Sharpness(2.0) = 2*img - SMOOTH(img), joyida (smoothed ustiga) + o'rtacha yorqinlik
+        luma_sum = 0
+        for box in strips:
+            sharpened = np.asarray(img.crop(box), dtype=np.int16) * 2 - np.asarray(smoothed.crop(box), dtype=np.int16)
+            strip = Image.fromarray(np.clip(sharpened, 0, 255).astype(np.uint8), 'RGB')
+            luma_sum += sum(value * count for value, count in enumerate(strip.convert('L').histogram()))
+            smoothed.paste(strip, box[:2])
+        mean_luma = int(luma_sum / (width * height) + 0.5)
+        
+        values = np.arange(256, dtype=np.uint8)
+        contrast = blend(mean_luma, values, 1.5)
+        color_brightness = blend(0, blend(values[:, None], values[None, :], 1.8), 1.2).ravel()
+        
+        for box in strips:
+            strip = smoothed.crop(box).point(contrast.tolist() * 3)
+            # (L, qiymat) indeksi 16 bitga sig'adi - intp indeks strip'dan 8 marta katta bo'lardi
+            luma = np.asarray(strip.convert('L'), dtype=np.uint16)[..., None]
+            index = np.left_shift(luma, 8) | np.asarray(strip)
+            block = np.take(color_brightness, index)
+            smoothed.paste(Image.fromarray(block, 'RGB'), box[:2])
+        
+        return smoothed.filter(ImageFilter.SMOOTH)
+    
+    @staticmethod
+    def enhance_old_photo(image_bytes):
         """Eski/xira rasmni zamonaviy, rangli, sifatli qilish"""
         try:
-            from PIL import Image, ImageEnhance, ImageFilter
-            import io
-            
             # Rasmni ochish
             img = Image.open(io.BytesIO(image_bytes))
             
@@ -240,24 +1497,11 @@ class ImageAnalyzer:
             if img.mode != 'RGB':
                 img = img.convert('RGB')
             
-            # 1. Keskinlikni oshirish (Sharpness)
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(2.0)  # 2x keskinroq
-            
-            # 2. Kontrastni oshirish
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.5)  # 1.5x kontrast
-            
-            # 3. Rangni oshirish (Saturation)
-            enhancer = ImageEnhance.Color(img)
-            img = enhancer.enhance(1.8)  # 1.8x rangli
-            
-            # 4. Yorug'likni muvozanatlash
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(1.2)  # 1.2x yorug'roq
-            
-            # 5. Shovqinni kamaytirish
-            img = img.filter(ImageFilter.SMOOTH)
+            # Keskinlik, kontrast, rang, yorug'lik va shovqin - bitta o'tishda
+            if np is not None:
+                img = ImageAnalyzer._enhance_fused(img)
+            else:
+                img = ImageAnalyzer._enhance_chain(img)
             
             # Yangi rasmni bytes ga aylantirish
             output = io.BytesIO()
@@ -963,6 +2207,425 @@ class ImageAnalyzer:
         }
 
 
+# Bitta analyzer barcha so'rovlar uchun
+vision_batcher = VisionBatcher(
+    google_credentials.vision_client, VISION_BATCH_WINDOW_MS / 1000, VISION_BATCH_SIZE, timeout=VISION_TIMEOUT_SECONDS
+)
+image_analyzer = ImageAnalyzer(google_credentials, vision_batcher)
+
+
+class ImageWorkerPool:
+    """
+    Process pool for CPU-bound PIL stages (enhancement, resizing) so a big
+    scanned photo never stalls the event loop or the GIL of the bot.
+    Workers are spawned (never forked from a process already running gRPC
+    threads) and re-import this module; with workers=0 stages run in a thread.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+
+    @staticmethod
+    def _warm_up():
+        return os.getpid()
+
+    async def start(self):
+        if not self.workers or self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        # spawn rejimida barcha worker'lar birinchi topshiriqda yaratiladi - import'ni loop kutmaydi
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._warm_up)
+        logger.info(f"🧵 Image worker pool started ({self.workers} processes)")
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool and await the result"""
+        if not self.workers:
+            return await asyncio.to_thread(fn, *args)
+        if self._executor is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # Worker o'lib qolsa pool bir marta qayta yaratiladi va topshiriq takrorlanadi
+            if self._executor is executor:
+                logger.error("💥 Image worker pool broken - recreating")
+                self.shutdown()
+                await self.start()
+            return await loop.run_in_executor(self._executor, fn, *args)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', str(min(2, os.cpu_count() or 1))))
+image_pool = ImageWorkerPool(IMAGE_WORKERS)
+
+
+def image_fingerprint(image_bytes):
+    """Return (SHA-256 content hash, 64-bit average perceptual hash) of an image"""
+    content_hash = hashlib.sha256(image_bytes).hexdigest()
+    
+    perceptual_hash = None
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        img.draft('L', (64, 64))  # JPEG uchun tez, to'liq decode qilinmaydi
+        pixels = list(img.convert('L').resize((8, 8), Image.Resampling.BILINEAR).getdata())
+        avg = sum(pixels) / len(pixels)
+        bits = 0
+        for pixel in pixels:
+            bits = (bits << 1) | (1 if pixel >= avg else 0)
+        perceptual_hash = f"{bits:016x}"
+    except Exception as e:
+        logger.warning(f"⚠️ Perceptual hash failed: {e}")
+    
+    return content_hash, perceptual_hash
+
+
+class AnalysisCache:
+    """
+    Content-addressed cache in front of ImageAnalyzer.
+    Entries are keyed by file_unique_id, content hash and perceptual hash.
+    In-memory LRU with TTL, optional on-disk tier and single-flight
+    coalescing of identical concurrent uploads. A near-match key (the
+    perceptual hash) is only a hint: callers pass accept() to verify the
+    exact content, and rejected hits are counted as near_duplicates.
+    """
+
+    def __init__(self, max_entries=1000, ttl=86400, disk_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'near_duplicates': 0
+        }
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ Corrupt cache file {path}: {e}")
+            record = {'expires_at': 0}
+        
+        if record.get('expires_at', 0) < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return record
+
+    def _write_disk(self, keys, value, expires_at):
+        for key in keys:
+            path = self._disk_path(key)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'expires_at': expires_at, 'value': value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+    def _remember(self, key, value, expires_at):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _accepted(self, value, accept):
+        if accept is None or accept(value):
+            return True
+        self.counters['near_duplicates'] += 1
+        return False
+
+    async def get(self, *keys, accept=None):
+        """Look keys up in memory, then on disk; return the first live value accept() allows"""
+        now = time.time()
+        for key in keys:
+            entry = self._memory.get(key)
+            if entry:
+                if entry[0] < now:
+                    del self._memory[key]
+                elif self._accepted(entry[1], accept):
+                    self._memory.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return entry[1]
+        
+        if self.disk_dir:
+            for key in keys:
+                try:
+                    record = await asyncio.to_thread(self._read_disk, key)
+                except Exception as e:
+                    logger.warning(f"⚠️ Cache disk read error: {e}")
+                    record = None
+                if record and self._accepted(record['value'], accept):
+                    self.counters['disk_hits'] += 1
+                    for k in keys:
+                        self._remember(k, record['value'], record['expires_at'])
+                    return record['value']
+        
+        self.counters['misses'] += 1
+        return None
+
+    async def put(self, keys, value):
+        expires_at = time.time() + self.ttl
+        for key in keys:
+            self._remember(key, value, expires_at)
+        
+        if self.disk_dir:
+            try:
+                await asyncio.to_thread(self._write_disk, keys, value, expires_at)
+            except Exception as e:
+                logger.warning(f"⚠️ Cache disk write error: {e}")
+
+    async def get_or_compute(self, keys, compute, accept=None):
+        """
+        Return the cached value for any of keys, or run compute() once.
+        Concurrent callers with the same first key share one computation;
+        if that computation is cancelled a waiter takes it over.
+        None results are not cached.
+        """
+        keys = [key for key in keys if key]
+        flight_key = keys[0]
+        while True:
+            value = await self.get(*keys, accept=accept)
+            if value is not None:
+                return value
+            
+            future = self._inflight.get(flight_key)
+            if future is None:
+                break
+            self.counters['coalesced'] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # Bu so'rovning o'zi bekor qilindi
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[flight_key] = future
+        try:
+            value = await compute()
+            if value is not None:
+                await self.put(keys, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # Kutayotgan boshqa so'rovlar bo'lmasa "exception never retrieved" bo'lmasin
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(flight_key, None)
+            # Leader bekor qilinsa (CancelledError) kutayotganlar osilib qolmasin
+            if not future.done():
+                future.cancel()
+
+    def stats(self):
+        hits = self.counters['memory_hits'] + self.counters['disk_hits']
+        lookups = hits + self.counters['misses']
+        return {
+            **self.counters,
+            'entries': len(self._memory),
+            'hit_rate': (hits / lookups) if lookups else 0.0
+        }
+
+
+# Tahlil keshi (bir xil rasm qayta-qayta yuborilganda)
+ANALYSIS_CACHE_SIZE = int(os.getenv('ANALYSIS_CACHE_SIZE', '1000'))
+ANALYSIS_CACHE_TTL = int(os.getenv('ANALYSIS_CACHE_TTL', '86400'))
+ANALYSIS_CACHE_DIR = os.getenv('ANALYSIS_CACHE_DIR') or None
+
+analysis_cache = AnalysisCache(
+    max_entries=ANALYSIS_CACHE_SIZE,
+    ttl=ANALYSIS_CACHE_TTL,
+    disk_dir=ANALYSIS_CACHE_DIR
+)
+
+
+class VideoResultStore:
+    """
+    Maps (image content hash, scenario name, prompt) to the Telegram file_id
+    of an already delivered video, so identical requests are re-sent instead
+    of regenerated. generate_uzbek_prompt() picks a random phrase each time,
+    so the scenario first chosen for an image is remembered too and reused
+    for that image. Oldest entries are evicted once max_entries is reached.
+    """
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._styles = OrderedDict()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def style_for(self, content_hash, choose):
+        """The scenario first chosen for this image; choose() runs only the first time"""
+        style = self._styles.get(content_hash)
+        if style is None:
+            style = choose()
+            self._styles[content_hash] = style
+        self._styles.move_to_end(content_hash)
+        while len(self._styles) > self.max_entries:
+            self._styles.popitem(last=False)
+        return style
+
+    @staticmethod
+    def make_key(content_hash, scenario_name, prompt):
+        raw = '\x1f'.join([content_hash, scenario_name, prompt])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        file_id = self._entries.get(key)
+        if file_id is None:
+            self.counters['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.counters['hits'] += 1
+        return file_id
+
+    def put(self, key, file_id):
+        self._entries[key] = file_id
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+VIDEO_RESULT_STORE_SIZE = int(os.getenv('VIDEO_RESULT_STORE_SIZE', '5000'))
+video_results = VideoResultStore(max_entries=VIDEO_RESULT_STORE_SIZE)
+
+
+class VideoDelivery:
+    """
+    Turns a finished Veo video into a file-like object for send_video.
+    Videos up to spill_threshold bytes are decoded in a worker thread (or
+    streamed from the media bucket) once into memory and handed over as a
+    BytesIO view - no copy, no disk. Larger videos go chunk by chunk into a temp file off the
+    event loop; the file is always removed afterwards, even if sending fails.
+    """
+
+    TEMP_PREFIX = 'temp_video_'
+
+    def __init__(self, spill_threshold=20 * 1024 * 1024, spill_dir=None,
+                 chunk_size=4 * 1024 * 1024, storage=None):
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir or tempfile.gettempdir()
+        self.storage = storage
+        # base64 bo'laklari 4 belgiga karrali bo'lishi kerak
+        self.chunk_size = chunk_size - chunk_size % 4
+
+    def _spill(self, encoded):
+        fd, path = tempfile.mkstemp(prefix=self.TEMP_PREFIX, suffix='.mp4', dir=self.spill_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                view = memoryview(encoded.encode('ascii') if isinstance(encoded, str) else encoded)
+                for offset in range(0, len(view), self.chunk_size):
+                    f.write(base64.b64decode(view[offset:offset + self.chunk_size]))
+            return path
+        except Exception:
+            self._remove(path)
+            raise
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"⚠️ Could not remove temp video {path}: {e}")
+
+    @contextlib.asynccontextmanager
+    async def _open_stored(self, uri):
+        """Stream a bucket object into memory, or into a temp file if large"""
+        async with self.storage.open_read(uri) as (size, chunks):
+            if size is not None and size <= self.spill_threshold:
+                parts = [chunk async for chunk in chunks]
+                yield io.BytesIO(b''.join(parts))
+                return
+            
+            fd, path = tempfile.mkstemp(prefix=self.TEMP_PREFIX, suffix='.mp4', dir=self.spill_dir)
+            video_file = os.fdopen(fd, 'w+b')
+            try:
+                async for chunk in chunks:
+                    await asyncio.to_thread(video_file.write, chunk)
+                await asyncio.to_thread(video_file.seek, 0)
+                yield video_file
+            finally:
+                video_file.close()
+                await asyncio.to_thread(self._remove, path)
+
+    @contextlib.asynccontextmanager
+    async def open(self, video_info):
+        """Yield a readable file-like object with the video bytes"""
+        if 'gcsUri' in video_info:
+            if not self.storage:
+                raise RuntimeError("Video stored in a bucket but no media storage is configured")
+            async with self._open_stored(video_info['gcsUri']) as video_file:
+                yield video_file
+            return
+        
+        # base64 satrini javobdan olib tashlaymiz - keraksiz nusxa xotirada qolmasin
+        encoded = video_info.pop('bytesBase64Encoded')
+        decoded_size = len(encoded) * 3 // 4
+        
+        if decoded_size <= self.spill_threshold:
+            # 20 MB gacha decode ham event loop'dan tashqarida
+            video_bytes = await asyncio.to_thread(base64.b64decode, encoded)
+            del encoded
+            yield io.BytesIO(video_bytes)
+            return
+        
+        logger.info(f"💾 Large video ({decoded_size // 1024} KB) - spilling to disk")
+        path = await asyncio.to_thread(self._spill, encoded)
+        del encoded
+        video_file = await asyncio.to_thread(open, path, 'rb')
+        try:
+            yield video_file
+        finally:
+            video_file.close()
+            await asyncio.to_thread(self._remove, path)
+
+    def cleanup_stale(self, max_age=3600):
+        """Remove temp videos leaked by a crash of a previous run"""
+        removed = 0
+        try:
+            names = os.listdir(self.spill_dir)
+        except OSError:
+            return 0
+        for name in names:
+            if not (name.startswith(self.TEMP_PREFIX) and name.endswith('.mp4')):
+                continue
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if time.time() - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        if removed:
+            logger.info(f"🧹 Removed {removed} stale temp video(s)")
+        return removed
+
+
 # 10 ta yangi emotsional promtlar (ZAHIRA sifatida saqlanadi)
 VIDEO_PROMPTS_BACKUP = [
     {
@@ -1031,49 +2694,347 @@ VIDEO_PROMPTS_BACKUP = [
     }
 ]
 
+class AsyncHttpClient:
+    """
+    Shared non-blocking HTTP client with keep-alive connection pooling.
+    Requests to the same host are additionally capped by a per-host semaphore.
+    """
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20,
+                 per_host_limit=20, timeout=60):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self._client = None
+        self._host_limits = {}
+
+    @property
+    def client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=60
+                ),
+                timeout=httpx.Timeout(self.timeout),
+                trust_env=False
+            )
+        return self._client
+
+    def _host_limit(self, url):
+        host = httpx.URL(url).host
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_limits[host]
+
+    async def request(self, method, url, **kwargs):
+        async with self._host_limit(url):
+            return await self.client.request(method, url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, **kwargs):
+        """Streaming request; the body is not read into memory up front"""
+        async with self._host_limit(url):
+            async with self.client.stream(method, url, **kwargs) as response:
+                yield response
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Bitta umumiy HTTP client (Telegram + Vertex AI)
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_PER_HOST_LIMIT = int(os.getenv('HTTP_PER_HOST_LIMIT', '20'))
+
+http_client = AsyncHttpClient(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    per_host_limit=HTTP_PER_HOST_LIMIT
+)
+
+
+class GcsMediaStorage:
+    """
+    Veo inputs and outputs in a Cloud Storage bucket (JSON API over the
+    shared HTTP client). Inputs are passed to Veo as gcsUri and Veo writes
+    the MP4 to storageUri, so no media travels inside the JSON bodies.
+    """
+
+    def __init__(self, bucket, credentials, http, prefix='jonlantir'):
+        self.bucket = bucket
+        self.credentials = credentials
+        self.http = http
+        self.prefix = prefix.strip('/')
+
+    def uri(self, name):
+        return f"gs://{self.bucket}/{self.prefix}/{name}"
+
+    def _object_name(self, uri):
+        bucket, _, name = uri[len('gs://'):].partition('/')
+        if bucket != self.bucket:
+            raise ValueError(f"URI outside of bucket {self.bucket}: {uri}")
+        return name
+
+    async def _headers(self):
+        token = await self.credentials.get_token()
+        return {"Authorization": f"Bearer {token}"}
+
+    async def upload(self, name, data, content_type):
+        """Upload bytes and return their gs:// URI"""
+        uri = self.uri(name)
+        headers = await self._headers()
+        headers["Content-Type"] = content_type
+        response = await self.http.post(
+            f"https://storage.googleapis.com/upload/storage/v1/b/{self.bucket}/o",
+            params={"uploadType": "media", "name": self._object_name(uri)},
+            content=data,
+            headers=headers,
+            timeout=60
+        )
+        response.raise_for_status()
+        logger.info(f"☁️ Uploaded {len(data)} bytes to {uri}")
+        return uri
+
+    @contextlib.asynccontextmanager
+    async def open_read(self, uri, chunk_size=1024 * 1024):
+        """Yield (size or None, async iterator of chunks) for a gs:// object"""
+        url = (
+            f"https://storage.googleapis.com/storage/v1/b/{self.bucket}/o/"
+            f"{quote(self._object_name(uri), safe='')}"
+        )
+        async with self.http.stream('GET', url, params={"alt": "media"},
+                                    headers=await self._headers(), timeout=120) as response:
+            response.raise_for_status()
+            size = response.headers.get('content-length')
+            yield (int(size) if size else None), response.aiter_bytes(chunk_size)
+
+
+class LocalMediaStorage:
+    """
+    Filesystem stand-in for GcsMediaStorage, for tests only: the URIs it
+    hands out are not readable by the real Veo API, so it is never wired
+    into veo_generator. gs://<bucket>/<name> maps to <root_dir>/<name>.
+    """
+
+    def __init__(self, root_dir, bucket='local-bucket', prefix='jonlantir'):
+        self.root_dir = root_dir
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        os.makedirs(root_dir, exist_ok=True)
+
+    def uri(self, name):
+        return f"gs://{self.bucket}/{self.prefix}/{name}"
+
+    def _path(self, uri):
+        bucket, _, name = uri[len('gs://'):].partition('/')
+        if bucket != self.bucket:
+            raise ValueError(f"URI outside of bucket {self.bucket}: {uri}")
+        path = os.path.abspath(os.path.join(self.root_dir, name))
+        if not path.startswith(os.path.abspath(self.root_dir) + os.sep):
+            raise ValueError(f"Invalid object name: {uri}")
+        return path
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    async def upload(self, name, data, content_type):
+        uri = self.uri(name)
+        await asyncio.to_thread(self._write, self._path(uri), data)
+        return uri
+
+    @contextlib.asynccontextmanager
+    async def open_read(self, uri, chunk_size=1024 * 1024):
+        path = self._path(uri)
+        f = await asyncio.to_thread(open, path, 'rb')
+        try:
+            async def chunks():
+                while True:
+                    chunk = await asyncio.to_thread(f.read, chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            yield os.path.getsize(path), chunks()
+        finally:
+            f.close()
+
+
+# Ixtiyoriy bucket rejimi (GCS). LocalMediaStorage faqat testlar uchun - haqiqiy Veo
+# lokal gs:// URI'ni o'qiy olmaydi, shuning uchun production'ga ulanmaydi
+VEO_MEDIA_BUCKET = os.getenv('VEO_MEDIA_BUCKET')
+
+if VEO_MEDIA_BUCKET:
+    media_storage = GcsMediaStorage(VEO_MEDIA_BUCKET, google_credentials, http_client)
+else:
+    media_storage = None
+
+VIDEO_SPILL_THRESHOLD = int(os.getenv('VIDEO_SPILL_THRESHOLD_MB', '20')) * 1024 * 1024
+VIDEO_SPILL_DIR = os.getenv('VIDEO_SPILL_DIR') or None
+
+video_delivery = VideoDelivery(
+    spill_threshold=VIDEO_SPILL_THRESHOLD,
+    spill_dir=VIDEO_SPILL_DIR,
+    storage=media_storage
+)
+
+
+class ModelHealthTracker:
+    """
+    Health of each model in the Veo fallback chain.
+    Keeps recent status codes and latencies, honours Retry-After on 429 and
+    trips a circuit breaker so broken models are skipped for a cool-off
+    window. After the window a single probe request is let through.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, cooloff=300, not_found_cooloff=3600, history=20):
+        self.failure_threshold = failure_threshold
+        self.cooloff = cooloff
+        self.not_found_cooloff = not_found_cooloff
+        self.history = history
+        self.models = {}
+
+    def _state(self, model_id):
+        if model_id not in self.models:
+            self.models[model_id] = {
+                'state': self.CLOSED,
+                'failures': 0,
+                'open_until': 0,
+                'probing': False,
+                'recent': deque(maxlen=self.history)
+            }
+        return self.models[model_id]
+
+    def allow(self, model_id):
+        """Whether a request to this model should be attempted now"""
+        state = self._state(model_id)
+        if state['state'] == self.OPEN:
+            if time.time() < state['open_until']:
+                return False
+            state['state'] = self.HALF_OPEN
+            state['probing'] = False
+        
+        if state['state'] == self.HALF_OPEN:
+            if state['probing']:
+                return False
+            state['probing'] = True
+        return True
+
+    def release_probe(self, model_id):
+        """Free the half-open probe slot when an attempt ends without a record (e.g. cancelled)"""
+        self._state(model_id)['probing'] = False
+
+    def _trip(self, model_id, state, duration):
+        state['state'] = self.OPEN
+        state['open_until'] = time.time() + duration
+        logger.warning(f"🔌 Circuit OPEN for {model_id} ({int(duration)}s)")
+
+    def record(self, model_id, status_code, latency, retry_after=None):
+        """Record one attempt; status_code None means a network error/timeout"""
+        state = self._state(model_id)
+        state['recent'].append((time.time(), status_code, latency))
+        state['probing'] = False
+        
+        if status_code == 200:
+            if state['state'] != self.CLOSED:
+                logger.info(f"🔌 Circuit CLOSED for {model_id}")
+            state['state'] = self.CLOSED
+            state['failures'] = 0
+        elif status_code == 429:
+            self._trip(model_id, state, retry_after or self.cooloff)
+        elif status_code == 404:
+            self._trip(model_id, state, self.not_found_cooloff)
+        elif status_code is None or status_code >= 500:
+            state['failures'] += 1
+            if state['state'] == self.HALF_OPEN or state['failures'] >= self.failure_threshold:
+                self._trip(model_id, state, self.cooloff)
+        elif state['state'] == self.HALF_OPEN:
+            # So'rovga xos xato (400 va h.k.) - model sog'ligini ko'rsatmaydi
+            state['state'] = self.CLOSED
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Retry-After as seconds (delta-seconds or HTTP date), or None"""
+        if not value:
+            return None
+        try:
+            return max(0, int(value))
+        except ValueError:
+            pass
+        try:
+            return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+        except Exception:
+            return None
+
+    def snapshot(self, model_ids):
+        """Current state of each model, for the admin panel"""
+        now = time.time()
+        result = []
+        for model_id in model_ids:
+            state = self._state(model_id)
+            latencies = sorted(r[2] for r in state['recent'] if r[1] == 200)
+            result.append({
+                'model': model_id,
+                'state': state['state'],
+                'open_for': max(0, int(state['open_until'] - now)) if state['state'] == self.OPEN else 0,
+                'last_status': state['recent'][-1][1] if state['recent'] else None,
+                'median_latency': latencies[len(latencies) // 2] if latencies else None,
+                'attempts': len(state['recent'])
+            })
+        return result
+
+
 class GoogleVeoVideoGenerator:
-    def __init__(self, project_id, location, service_account_file):
+    # TEZ MODELLAR
+    VEO_MODELS = [
+        'veo-3.0-fast-generate-001',
+        'veo-3.1-fast-generate-preview',
+        'veo-3.0-generate-001',
+        'veo-3.1-generate-preview',
+        'veo-2.0-generate-001',
+    ]
+
+    def __init__(self, project_id, location, credentials, http, storage=None, health=None):
         self.project_id = project_id
         self.location = location
-        self.service_account_file = service_account_file
-        self.access_token = None
-        self.token_expiry = None
+        self.credentials = credentials
+        self.http = http
+        self.storage = storage
+        self.health = health or ModelHealthTracker()
     
-    def get_access_token(self):
-        """Get OAuth2 access token using service account"""
+    async def get_access_token(self):
+        """Get OAuth2 access token from the shared credential manager"""
         try:
-            if self.access_token and self.token_expiry and time.time() < self.token_expiry:
-                return self.access_token
-            
-            if os.path.exists(self.service_account_file):
-                credentials = service_account.Credentials.from_service_account_file(
-                    self.service_account_file,
-                    scopes=['https://www.googleapis.com/auth/cloud-platform']
-                )
-                
-                session = requests.Session()
-                session.trust_env = False
-                request = Request(session)
-                
-                credentials.refresh(request)
-                self.access_token = credentials.token
-                self.token_expiry = time.time() + 3300
-                return self.access_token
-            else:
-                logger.error(f"Service account file not found: {self.service_account_file}")
-                return None
-                
+            return await self.credentials.get_token()
+        except FileNotFoundError:
+            logger.error(f"Service account file not found: {self.credentials.service_account_file}")
+            return None
         except Exception as e:
             logger.error(f"Error getting access token: {e}")
             return None
 
-    def create_video_from_image(self, image_url=None, prompt="", duration=6, image_bytes=None):
+    async def create_video_from_image(self, image_url=None, prompt="", duration=6, image_bytes=None):
         """
         Create video from image using Google Veo API
         Accepts either image_url OR image_bytes
         """
         try:
-            token = self.get_access_token()
+            token = await self.get_access_token()
             if not token:
                 logger.error("Failed to get access token")
                 return None
@@ -1086,9 +3047,7 @@ class GoogleVeoVideoGenerator:
             elif image_url:
                 # Agar URL berilgan bo'lsa
                 logger.info(f"📥 Downloading image from: {image_url}")
-                session = requests.Session()
-                session.trust_env = False
-                response = session.get(image_url, timeout=20)
+                response = await self.http.get(image_url, timeout=20)
                 response.raise_for_status()
                 image_content = response.content
                 logger.info(f"✅ Image downloaded, size: {len(image_content)} bytes")
@@ -1096,26 +3055,40 @@ class GoogleVeoVideoGenerator:
                 logger.error("Neither image_url nor image_bytes provided")
                 return None
                 
-            image_base64 = base64.b64encode(image_content).decode('utf-8')
-            
             # Determine MIME type
             mime_type = 'image/jpeg'
             
+            # Bucket rejimi: rasm bir marta yuklanadi, Veo videoni bucket'ga yozadi
+            parameters_extra = {}
+            if self.storage:
+                image_name = f"inputs/{hashlib.sha256(image_content).hexdigest()}.jpg"
+                image_field = {
+                    "gcsUri": await self.storage.upload(image_name, image_content, mime_type),
+                    "mimeType": mime_type
+                }
+                parameters_extra["storageUri"] = self.storage.uri(f"outputs/{uuid.uuid4().hex}/")
+            else:
+                image_field = {
+                    # Katta rasm uchun bir necha ms - event loop'dan tashqarida
+                    "bytesBase64Encoded": (await asyncio.to_thread(base64.b64encode, image_content)).decode('ascii'),
+                    "mimeType": mime_type
+                }
+            
+            # JSON faqat har bir resolution uchun bir marta serialize qilinadi
+            request_bodies = {}
+            
             # Auto-detect aspect ratio from image dimensions
             img = Image.open(io.BytesIO(image_content))
             img_width, img_height = img.size
             aspect_ratio = "9:16" if img_height > img_width else "16:9"
             
-            # TEZ MODELLAR
-            veo_models = [
-                'veo-3.0-fast-generate-001',
-                'veo-3.1-fast-generate-preview',
-                'veo-3.0-generate-001',
-                'veo-3.1-generate-preview',
-                'veo-2.0-generate-001',
-            ]
-            
-            for model_id in veo_models:
+            for model_id in self.VEO_MODELS:
+                # Ishlamayotgan modellar cool-off davomida o'tkazib yuboriladi
+                if not self.health.allow(model_id):
+                    logger.info(f"⏭️ Skipping {model_id} (circuit open)")
+                    continue
+                
+                started = time.perf_counter()
                 try:
                     endpoint = (
                         f"https://{self.location}-aiplatform.googleapis.com/v1/"
@@ -1125,25 +3098,25 @@ class GoogleVeoVideoGenerator:
                     
                     resolution = "1080p" if model_id.startswith('veo-3') else "720p"
                     
-                    payload = {
-                        "instances": [
-                            {
-                                "prompt": prompt,
-                                "image": {
-                                    "bytesBase64Encoded": image_base64,
-                                    "mimeType": mime_type
+                    if resolution not in request_bodies:
+                        payload = {
+                            "instances": [
+                                {
+                                    "prompt": prompt,
+                                    "image": image_field
                                 }
+                            ],
+                            "parameters": {
+                                "aspectRatio": aspect_ratio,
+                                "durationSeconds": duration,
+                                "resolution": resolution,
+                                "enhancePrompt": True,
+                                "sampleCount": 1,
+                                "generateAudio": True,
+                                **parameters_extra
                             }
-                        ],
-                        "parameters": {
-                            "aspectRatio": aspect_ratio,
-                            "durationSeconds": duration,
-                            "resolution": resolution,
-                            "enhancePrompt": True,
-                            "sampleCount": 1,
-                            "generateAudio": True
                         }
-                    }
+                        request_bodies[resolution] = json.dumps(payload).encode('utf-8')
                     
                     headers = {
                         "Authorization": f"Bearer {token}",
@@ -1153,36 +3126,46 @@ class GoogleVeoVideoGenerator:
                     logger.info(f"🚀 Trying model: {model_id}")
                     logger.info(f"🖼 Aspect: {aspect_ratio} | Prompt: {prompt[:50]}...")
                     
-                    session = requests.Session()
-                    session.trust_env = False
-                    api_response = session.post(endpoint, json=payload, headers=headers, timeout=60)
+                    api_response = await self.http.post(
+                        endpoint, content=request_bodies[resolution], headers=headers, timeout=60
+                    )
                     
                     logger.info(f"📡 Response Status for {model_id}: {api_response.status_code}")
                     
+                    self.health.record(
+                        model_id,
+                        api_response.status_code,
+                        time.perf_counter() - started,
+                        retry_after=ModelHealthTracker.parse_retry_after(api_response.headers.get('retry-after'))
+                    )
+                    
                     if api_response.status_code == 200:
                         result = api_response.json()
                         logger.info(f"✅ SUCCESS with model: {model_id}")
                         return result
                     
-                    elif api_response.status_code == 404:
-                        continue
-                    
                     else:
                         continue
                         
                 except Exception as e:
+                    logger.warning(f"⚠️ {model_id} request error: {e}")
+                    self.health.record(model_id, None, time.perf_counter() - started)
                     continue
+                finally:
+                    # Probe bekor qilinsa (CancelledError) model abadiy o'tkazib yuborilmasin
+                    self.health.release_probe(model_id)
             
+            logger.error("❌ No Veo model accepted the request")
             return None
             
         except Exception as e:
             logger.error(f"Error in create_video_from_image: {e}")
             return None
 
-    def get_operation_status(self, operation_name):
+    async def get_operation_status(self, operation_name):
         """Check the status of a long-running operation"""
         try:
-            token = self.get_access_token()
+            token = await self.get_access_token()
             if not token:
                 return None
             
@@ -1208,9 +3191,7 @@ class GoogleVeoVideoGenerator:
                     "Content-Type": "application/json"
                 }
                 
-                session = requests.Session()
-                session.trust_env = False
-                response = session.post(endpoint, json=payload, headers=headers, timeout=40)
+                response = await self.http.post(endpoint, json=payload, headers=headers, timeout=40)
                 
                 if response.status_code != 200:
                     return None
@@ -1223,73 +3204,451 @@ class GoogleVeoVideoGenerator:
         except Exception as e:
             return None
 
-    def wait_for_video(self, operation_name, max_wait_time=1200, check_interval=15):
-        """Wait for video generation to complete"""
-        start_time = time.time()
-        last_log_time = start_time
-        consecutive_failures = 0
-        max_consecutive_failures = 10  # Ko'proq xatolarga ruxsat
-        
-        logger.info(f"⏳ Waiting for video completion...")
-        
-        while time.time() - start_time < max_wait_time:
-            current_time = time.time()
-            
+
+class VeoOperationTracker:
+    """
+    Track every in-flight Veo operation from a single event-loop task.
+    Each job gets a future that resolves with the operation response
+    (or None on failure/timeout) instead of parking a thread per job.
+    """
+
+    def __init__(self, generator, check_interval=15, max_wait_time=1200,
+                 max_consecutive_failures=10, max_parallel_polls=8):
+        self.generator = generator
+        self.check_interval = check_interval
+        self.max_wait_time = max_wait_time
+        self.max_consecutive_failures = max_consecutive_failures
+        self.max_parallel_polls = max_parallel_polls
+        self.pending = {}
+        self._task = None
+        self._wakeup = None
+
+    def track(self, operation_name, start_time=None):
+        """Register an operation and return the future for its result"""
+        entry = self.pending.get(operation_name)
+        if entry and not entry['future'].done():
+            return entry['future']
+
+        loop = asyncio.get_running_loop()
+        now = time.time()
+        self.pending[operation_name] = {
+            'future': loop.create_future(),
+            'start_time': start_time or now,
+            'next_poll': now + self.check_interval,
+            'failures': 0
+        }
+
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        return self.pending[operation_name]['future']
+
+    async def wait(self, operation_name, start_time=None):
+        """Wait for an operation; cancelling the waiter stops tracking it"""
+        return await self.track(operation_name, start_time)
+
+    def _resolve(self, operation_name, result):
+        entry = self.pending.pop(operation_name, None)
+        if entry and not entry['future'].done():
+            entry['future'].set_result(result)
+
+    async def _run(self):
+        logger.info("🛰️ Veo operation tracker started")
+        semaphore = asyncio.Semaphore(self.max_parallel_polls)
+
+        try:
+            while self.pending:
+                # Waiters that were cancelled no longer need polling
+                for name in [n for n, e in self.pending.items() if e['future'].done()]:
+                    self.pending.pop(name, None)
+
+                now = time.time()
+                due = [name for name, e in self.pending.items() if e['next_poll'] <= now]
+
+                if due:
+                    await asyncio.gather(*(self._poll(name, semaphore) for name in due))
+                    logger.info(f"🔄 Tracking {len(self.pending)} Veo operation(s)")
+
+                if not self.pending:
+                    break
+
+                next_poll = min(e['next_poll'] for e in self.pending.values())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(1, next_poll - time.time()))
+                except asyncio.TimeoutError:
+                    pass
+        except Exception as e:
+            logger.error(f"Operation tracker error: {e}")
+            for name in list(self.pending):
+                self._resolve(name, None)
+        finally:
+            logger.info("🛰️ Veo operation tracker idle")
+
+    async def _poll(self, operation_name, semaphore):
+        entry = self.pending.get(operation_name)
+        if not entry:
+            return
+
+        if time.time() - entry['start_time'] >= self.max_wait_time:
+            logger.error(f"⏱️ Timeout reached after {self.max_wait_time} seconds: {operation_name}")
+            self._resolve(operation_name, None)
+            return
+
+        async with semaphore:
             try:
-                status = self.get_operation_status(operation_name)
+                status = await self.generator.get_operation_status(operation_name)
             except Exception as e:
                 logger.warning(f"⚠️ Status check error (will retry): {e}")
-                consecutive_failures += 1
-                if consecutive_failures >= max_consecutive_failures:
-                    logger.error(f"❌ Too many consecutive failures")
-                    return None
-                time.sleep(check_interval * 2)
-                continue
-            
-            if not status:
-                consecutive_failures += 1
-                logger.warning(f"⚠️ No status received ({consecutive_failures}/{max_consecutive_failures})")
-                if consecutive_failures >= max_consecutive_failures:
-                    logger.error(f"❌ Too many consecutive failures")
-                    return None
-                time.sleep(check_interval * 2)
-                continue
-            
-            consecutive_failures = 0
-            
-            if status.get('done'):
-                if 'error' in status:
-                    error_info = status['error']
-                    error_message = error_info.get('message', 'Unknown error')
-                    logger.error(f"Operation failed: {error_message}")
-                    return None
-                
-                if 'response' in status:
-                    elapsed_time = int(time.time() - start_time)
-                    logger.info(f"🎉 Video completed in {elapsed_time} seconds!")
-                    return status['response']
-                
-                return None
-            
-            if current_time - last_log_time > 30:
-                elapsed_time = int(current_time - start_time)
-                progress_minutes = elapsed_time // 60
-                logger.info(f"🔄 Generating... ({progress_minutes}m {elapsed_time % 60}s)")
-                last_log_time = current_time
-            
-            time.sleep(check_interval)
-        
-        logger.error(f"⏱️ Timeout reached after {max_wait_time} seconds")
-        return None
+                status = None
+
+        if operation_name not in self.pending:
+            return
+
+        if not status:
+            entry['failures'] += 1
+            logger.warning(f"⚠️ No status received ({entry['failures']}/{self.max_consecutive_failures})")
+            if entry['failures'] >= self.max_consecutive_failures:
+                logger.error(f"❌ Too many consecutive failures")
+                self._resolve(operation_name, None)
+                return
+            entry['next_poll'] = time.time() + self.check_interval * 2
+            return
+
+        entry['failures'] = 0
+        entry['next_poll'] = time.time() + self.check_interval
+
+        if status.get('done'):
+            if 'error' in status:
+                error_message = status['error'].get('message', 'Unknown error')
+                logger.error(f"Operation failed: {error_message}")
+                self._resolve(operation_name, None)
+                return
+
+            if 'response' in status:
+                elapsed_time = int(time.time() - entry['start_time'])
+                logger.info(f"🎉 Video completed in {elapsed_time} seconds!")
+                self._resolve(operation_name, status['response'])
+                return
+
+            self._resolve(operation_name, None)
 
 
 # Initialize Veo generator
 veo_generator = GoogleVeoVideoGenerator(
     GOOGLE_PROJECT_ID,
     GOOGLE_LOCATION,
-    GOOGLE_SERVICE_ACCOUNT_FILE
+    google_credentials,
+    http_client,
+    storage=media_storage
 )
 
+# Bitta poller barcha operatsiyalar uchun
+operation_tracker = VeoOperationTracker(veo_generator)
+
+
+def model_from_operation(operation_name):
+    """Extract the model id from a Veo operation name"""
+    parts = operation_name.split('/')
+    if 'models' in parts and parts.index('models') + 1 < len(parts):
+        return parts[parts.index('models') + 1]
+    return None
+
+
+class JobStore:
+    """
+    Durable table of submitted Veo jobs (SQLite, WAL).
+    Unfinished rows are resumed on startup; finished and stale rows are
+    compacted periodically.
+    """
+
+    UNFINISHED = 'running'
+
+    def __init__(self, db_file, retention=86400, max_job_age=3600):
+        self.db_file = db_file
+        self.retention = retention
+        self.max_job_age = max_job_age
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # Har bir jarayon o'z ulanishiga ega bo'ladi (fork'dan keyin ham)
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " operation_name TEXT PRIMARY KEY,"
+                " chat_id INTEGER NOT NULL,"
+                " user_id INTEGER NOT NULL,"
+                " message_id INTEGER,"
+                " model TEXT,"
+                " submit_time REAL NOT NULL,"
+                " status TEXT NOT NULL,"
+                " updated_time REAL NOT NULL,"
+                " result_key TEXT,"
+                " reservation TEXT)"
+            )
+            try:
+                # Eski jadval: rezervatsiya tokeni saqlanmagan edi
+                conn.execute("ALTER TABLE jobs ADD COLUMN reservation TEXT")
+            except sqlite3.OperationalError:
+                pass  # Ustun allaqachon mavjud
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, updated_time)")
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._connection().execute(sql, params).fetchall()]
+
+    async def add(self, job):
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO jobs (operation_name, chat_id, user_id, message_id, model,"
+            " submit_time, status, updated_time, result_key, reservation)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job['operation_name'], job['chat_id'], job['user_id'], job.get('message_id'),
+             job.get('model'), job['submit_time'], self.UNFINISHED, time.time(), job.get('result_key'),
+             # Cooldown tokeni (float yoki str) JSON sifatida aynan tiklanadi
+             json.dumps(job.get('reservation')))
+        )
+
+    async def finish(self, operation_name, status):
+        try:
+            await asyncio.to_thread(
+                self._execute,
+                "UPDATE jobs SET status = ?, updated_time = ? WHERE operation_name = ?",
+                (status, time.time(), operation_name)
+            )
+        except Exception as e:
+            logger.error(f"Job store update error: {e}")
+
+    async def unfinished(self):
+        jobs = await asyncio.to_thread(
+            self._query,
+            "SELECT * FROM jobs WHERE status = ? ORDER BY submit_time",
+            (self.UNFINISHED,)
+        )
+        for job in jobs:
+            job['reservation'] = json.loads(job['reservation']) if job['reservation'] else None
+        return jobs
+
+    async def has_unfinished(self, user_id):
+        rows = await asyncio.to_thread(
+            self._query,
+            "SELECT 1 FROM jobs WHERE status = ? AND user_id = ? LIMIT 1",
+            (self.UNFINISHED, user_id)
+        )
+        return bool(rows)
+
+    def _compact(self):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            expired = conn.execute(
+                "UPDATE jobs SET status = 'expired', updated_time = ? WHERE status = ? AND submit_time < ?",
+                (now, self.UNFINISHED, now - self.max_job_age)
+            ).rowcount
+            deleted = conn.execute(
+                "DELETE FROM jobs WHERE status != ? AND updated_time < ?",
+                (self.UNFINISHED, now - self.retention)
+            ).rowcount
+            conn.commit()
+        return expired, deleted
+
+    async def compact(self):
+        expired, deleted = await asyncio.to_thread(self._compact)
+        if expired or deleted:
+            logger.info(f"🧹 Job store compacted: {expired} expired, {deleted} deleted")
+        return expired, deleted
+
+    async def run_compactor(self, interval=3600):
+        while True:
+            try:
+                await self.compact()
+            except Exception as e:
+                logger.error(f"Job store compaction error: {e}")
+            await asyncio.sleep(interval)
+
+
+JOB_DB_FILE = os.getenv('JOB_DB_FILE', 'jobs.sqlite3')
+job_store = JobStore(JOB_DB_FILE, max_job_age=operation_tracker.max_wait_time * 2)
+
+class GenerationQueueFull(Exception):
+    """Raised when the generation queue sheds a job; eta is the expected wait in seconds"""
+
+    def __init__(self, eta):
+        super().__init__(f"Generation queue is full (ETA {int(eta)}s)")
+        self.eta = eta
+
+
+class GenerationQueue:
+    """
+    Central admission control for Veo generations.
+    At most max_in_flight operations run at once. Waiting jobs are served by
+    priority lane (lower first, admins = 0) and then in arrival order; once
+    max_waiting jobs are queued new ones are shed with an honest ETA.
+    """
+
+    ADMIN_PRIORITY = 0
+    USER_PRIORITY = 1
+
+    def __init__(self, max_in_flight=5, max_waiting=100, default_duration=180):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.default_duration = default_duration
+        self.in_flight = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._durations = deque(maxlen=50)
+
+    @property
+    def waiting(self):
+        return sum(1 for w in self._waiters if not w[2].done())
+
+    def is_full(self):
+        return self.in_flight >= self.max_in_flight and self.waiting >= self.max_waiting
+
+    def average_duration(self):
+        if not self._durations:
+            return self.default_duration
+        return sum(self._durations) / len(self._durations)
+
+    def estimate_wait(self, position):
+        """Expected seconds until the job at this 1-based queue position starts"""
+        rounds = (position + self.max_in_flight - 1) // self.max_in_flight
+        return rounds * self.average_duration()
+
+    def _grant(self):
+        self.in_flight += 1
+        return {'start_time': time.time()}
+
+    def _notify_positions(self):
+        live = [w for w in sorted(self._waiters) if not w[2].done()]
+        for position, waiter in enumerate(live, 1):
+            callback = waiter[3]
+            if callback and waiter[4] != position:
+                waiter[4] = position
+                try:
+                    callback(position, self.estimate_wait(position))
+                except Exception as e:
+                    logger.warning(f"⚠️ Queue position callback error: {e}")
+
+    async def acquire(self, priority=USER_PRIORITY, on_position=None):
+        """
+        Wait for a generation slot and return its ticket.
+        on_position(position, eta) is called whenever the job's place changes.
+        Raises GenerationQueueFull when the job is shed.
+        """
+        if self.in_flight < self.max_in_flight and not self.waiting:
+            return self._grant()
+        
+        if self.waiting >= self.max_waiting and priority > self.ADMIN_PRIORITY:
+            raise GenerationQueueFull(self.estimate_wait(self.waiting + 1))
+        
+        future = asyncio.get_running_loop().create_future()
+        waiter = [priority, next(self._seq), future, on_position, None]
+        heapq.heappush(self._waiters, waiter)
+        self._notify_positions()
+        
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(future.result(), completed=False)
+            self._waiters = [w for w in self._waiters if w is not waiter]
+            heapq.heapify(self._waiters)
+            self._notify_positions()
+            raise
+
+    def force_acquire(self):
+        """Take a slot without waiting (jobs resumed after a restart are already running)"""
+        return self._grant()
+
+    def release(self, ticket, completed=True):
+        self.in_flight = max(0, self.in_flight - 1)
+        if completed:
+            self._durations.append(time.time() - ticket['start_time'])
+        
+        while self._waiters and self.in_flight < self.max_in_flight:
+            waiter = heapq.heappop(self._waiters)
+            if not waiter[2].done():
+                waiter[2].set_result(self._grant())
+        self._notify_positions()
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'max_in_flight': self.max_in_flight,
+            'avg_duration': self.average_duration()
+        }
+
+
+VEO_MAX_IN_FLIGHT = int(os.getenv('VEO_MAX_IN_FLIGHT', '5'))
+VEO_MAX_QUEUE = int(os.getenv('VEO_MAX_QUEUE', '100'))
+generation_queue = GenerationQueue(max_in_flight=VEO_MAX_IN_FLIGHT, max_waiting=VEO_MAX_QUEUE)
+
+
+def format_eta(seconds):
+    minutes = max(1, int(seconds + 59) // 60)
+    if minutes >= 60:
+        return f"{minutes // 60} soat {minutes % 60} daqiqa"
+    return f"{minutes} daqiqa"
+
+
+def queue_busy_text(eta):
+    return (
+        "┏━━━━━━━━━━━━━━━━━━━┓\n"
+        "┃ 🚦 **NAVBAT TO'LA** ┃\n"
+        "┗━━━━━━━━━━━━━━━━━━━┛\n\n"
+        "⚠️ Hozir juda ko'p video yaratilmoqda.\n\n"
+        f"🕐 **Taxminan {format_eta(eta)}** dan keyin qayta urinib ko'ring\n\n"
+        "━━━━━━━━━━━━━━━━━━\n"
+        "🤖 @Jonlantir_Ai_bot\n"
+        "━━━━━━━━━━━━━━━━━━"
+    )
+
+
+def queue_position_text(position, eta):
+    return (
+        "┏━━━━━━━━━━━━━━━━━━━┓\n"
+        "┃ 🚦 **NAVBATDA** ┃\n"
+        "┗━━━━━━━━━━━━━━━━━━━┛\n\n"
+        f"👥 **Navbatdagi o'rningiz:** {position}\n"
+        f"🕐 **Taxminiy kutish:** {format_eta(eta)}\n\n"
+        "⏳ *Navbatingiz kelganda video yaratish boshlanadi...*"
+    )
+
+
+# Fon vazifalari (GC ularni yo'qotmasligi uchun havola saqlanadi)
+background_tasks = set()
+
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler for /start command"""
@@ -1325,6 +3684,406 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(welcome_message, parse_mode='Markdown')
 
 
+def build_video_caption(user_id, charged=True):
+    """Caption for a delivered video, with the next-video hint for regular users"""
+    next_video_time = ""
+    if charged and user_id not in ADMIN_IDS:
+        next_video_time = f"\n\n⏰ **Keyingi video:** {VIDEO_COOLDOWN_HOURS} soatdan keyin"
+    
+    # CHIROYLI CAPTION BOT LINKI BILAN
+    return (
+        "╔═══════════════════╗\n"
+        "║ 🎬 **VIDEO TAYYOR!** ║\n"
+        "╚═══════════════════╝\n\n"
+        "✅ *Muvaffaqiyatli yaratildi*"
+        f"{next_video_time}\n\n"
+        "📸 *Boshqa rasm yuboring!*\n\n"
+        "━━━━━━━━━━━━━━━━━━\n"
+        "🤖 @Jonlantir_Ai_bot\n"
+        "━━━━━━━━━━━━━━━━━━"
+    )
+
+
+async def send_cached_video(context, user_id, content_hash, style):
+    """
+    Re-send an already delivered video by file_id; True on success.
+    content_hash must be the SHA-256 of the bytes the user just uploaded.
+    A re-send is free: it is not recorded and does not start a cooldown.
+    """
+    key = VideoResultStore.make_key(content_hash, style['name'], style['prompt'])
+    file_id = video_results.get(key)
+    if not file_id:
+        return False
+    
+    try:
+        await context.bot.send_video(
+            chat_id=user_id,
+            video=file_id,
+            caption=build_video_caption(user_id, charged=False),
+            supports_streaming=True,
+            parse_mode='Markdown'
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Cached file_id re-send failed, regenerating: {e}")
+        return False
+    
+    logger.info(f"♻️ REUSED: User {user_id} - video re-sent by file_id")
+    return True
+
+
+class TokenBucket:
+    """Classic token bucket: rate tokens per second, up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self, now):
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def wait_time(self, now):
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class ProgressDispatcher:
+    """
+    Single task that owns every status-message edit.
+    Callers post the latest desired text and never wait for Telegram.
+    Superseded intermediate states are dropped, no-op edits are skipped and
+    edits are rate limited per chat and globally with token buckets
+    (RetryAfter pauses the whole dispatcher). Long-running jobs register a
+    ticker instead of running their own update loop.
+    """
+
+    def __init__(self, global_rate=20, chat_rate=0.5, chat_burst=3, ticker_interval=30, max_remembered=10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.ticker_interval = ticker_interval
+        self.max_remembered = max_remembered
+        self.bot = None
+        self._pending = OrderedDict()
+        self._sending = set()
+        self._last_sent = OrderedDict()
+        self._chat_buckets = {}
+        self._tickers = {}
+        self._paused_until = 0
+        self._wakeup = None
+        self._task = None
+        self.counters = {'sent': 0, 'superseded': 0, 'skipped': 0, 'rate_limited': 0}
+
+    def start(self, bot):
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def update(self, chat_id, message_id, text, parse_mode='Markdown'):
+        """Post the newest text for a status message (non-blocking)"""
+        if not message_id:
+            return
+        key = (chat_id, message_id)
+        if key in self._pending:
+            self.counters['superseded'] += 1
+        self._pending[key] = {'text': text, 'parse_mode': parse_mode, 'delete': False}
+        self._wake()
+
+    def delete(self, chat_id, message_id):
+        """Delete a status message; any pending edit or ticker is dropped"""
+        if not message_id:
+            return
+        key = (chat_id, message_id)
+        self._tickers.pop(key, None)
+        self._pending[key] = {'delete': True}
+        self._wake()
+
+    def start_ticker(self, chat_id, message_id, render, start_time):
+        """Re-render render(elapsed_seconds) every ticker_interval seconds"""
+        if not message_id:
+            return
+        self._tickers[(chat_id, message_id)] = {
+            'render': render,
+            'start_time': start_time,
+            'next_tick': time.time() + self.ticker_interval
+        }
+        self._wake()
+
+    def stop_ticker(self, chat_id, message_id):
+        self._tickers.pop((chat_id, message_id), None)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _tick(self):
+        now = time.time()
+        for key, ticker in list(self._tickers.items()):
+            if ticker['next_tick'] <= now:
+                ticker['next_tick'] = now + self.ticker_interval
+                try:
+                    text = ticker['render'](int(now - ticker['start_time']))
+                except Exception as e:
+                    logger.warning(f"⚠️ Progress ticker render error: {e}")
+                    continue
+                if key not in self._pending:
+                    self._pending[key] = {'text': text, 'parse_mode': 'Markdown', 'delete': False}
+        return min((t['next_tick'] for t in self._tickers.values()), default=now + 60) - now
+
+    def _dispatch(self):
+        """Start as many sends as the buckets allow; return seconds until the next chance"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        
+        next_wait = 60
+        for key in list(self._pending):
+            if key in self._sending:
+                continue
+            item = self._pending[key]
+            
+            if not item['delete'] and self._last_sent.get(key) == item['text']:
+                del self._pending[key]
+                self.counters['skipped'] += 1
+                continue
+            
+            chat_bucket = self._chat_bucket(key[0])
+            if not self.global_bucket.ready(now):
+                return min(next_wait, self.global_bucket.wait_time(now))
+            if not chat_bucket.ready(now):
+                next_wait = min(next_wait, chat_bucket.wait_time(now))
+                continue
+            
+            self.global_bucket.take(now)
+            chat_bucket.take(now)
+            del self._pending[key]
+            self._sending.add(key)
+            spawn_background(self._send(key, item))
+        
+        # Bo'sh va to'lgan chat bucket'larini tozalash
+        if len(self._chat_buckets) > 1000:
+            for chat_id, bucket in list(self._chat_buckets.items()):
+                if bucket.ready(now) and bucket.tokens >= bucket.capacity:
+                    del self._chat_buckets[chat_id]
+        return next_wait
+
+    async def _send(self, key, item):
+        chat_id, message_id = key
+        try:
+            if item['delete']:
+                await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+                self._last_sent.pop(key, None)
+            else:
+                await self.bot.edit_message_text(
+                    item['text'], chat_id=chat_id, message_id=message_id, parse_mode=item['parse_mode']
+                )
+                self._remember(key, item['text'])
+            self.counters['sent'] += 1
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            self.counters['rate_limited'] += 1
+            self._paused_until = time.monotonic() + retry_after
+            logger.warning(f"🚧 Telegram flood control - progress edits paused for {retry_after}s")
+            # Yangiroq holat bo'lmasa qayta navbatga qo'yamiz
+            self._pending.setdefault(key, item)
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                self._remember(key, item.get('text'))
+            else:
+                logger.warning(f"⚠️ Progress edit rejected: {e}")
+        except Exception as e:
+            logger.warning(f"⚠️ Progress edit failed: {e}")
+        finally:
+            self._sending.discard(key)
+            self._wake()
+
+    def _remember(self, key, text):
+        self._last_sent[key] = text
+        self._last_sent.move_to_end(key)
+        while len(self._last_sent) > self.max_remembered:
+            self._last_sent.popitem(last=False)
+
+    async def _run(self):
+        while True:
+            try:
+                wait = min(self._tick(), self._dispatch())
+            except Exception as e:
+                logger.error(f"Progress dispatcher error: {e}")
+                wait = 1
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.05, wait))
+            except asyncio.TimeoutError:
+                pass
+
+
+PROGRESS_GLOBAL_RATE = float(os.getenv('PROGRESS_GLOBAL_RATE', '20'))
+PROGRESS_CHAT_RATE = float(os.getenv('PROGRESS_CHAT_RATE', '0.5'))
+
+# Barcha status xabarlari shu dispatcher orqali tahrirlanadi
+progress = ProgressDispatcher(global_rate=PROGRESS_GLOBAL_RATE, chat_rate=PROGRESS_CHAT_RATE)
+
+
+def generating_text(elapsed):
+    """Status text for a running Veo job"""
+    minutes = elapsed // 60
+    seconds = elapsed % 60
+    
+    # Progress foizini hisoblash (taxminiy)
+    progress_percent = min(90 + (elapsed // 60), 99)
+    progress_bar = "▰" * (progress_percent // 10) + "▱" * (10 - progress_percent // 10)
+    
+    # Animatsion emoji
+    animation_frames = ["🎬", "🎨", "🎵", "✨", "🎭", "💫"]
+    emoji = animation_frames[(elapsed // 30) % len(animation_frames)]
+    
+    return (
+        "┏━━━━━━━━━━━━━━━━━━━┓\n"
+        f"┃ {emoji} **VIDEO TAYYORLANMOQDA** {emoji} ┃\n"
+        "┗━━━━━━━━━━━━━━━━━━━┛\n\n"
+        f"⏱️ *O'tgan vaqt:* **{minutes}m {seconds}s**\n"
+        f"📊 *Progress:* {progress_bar} {progress_percent}%\n\n"
+        "🎨 *AI ishlamoqda...*\n"
+        "🎵 *Audio qo'shilmoqda...*\n"
+        "🎬 *Sahna yaratilmoqda...*\n\n"
+        "⏳ *Iltimos, sabr qiling...*"
+    )
+
+
+async def run_generation_job(bot, job):
+    """
+    Wait for a submitted Veo job, deliver the video and record it.
+    Used both right after submission and for jobs resumed after a restart.
+    """
+    chat_id = job['chat_id']
+    user_id = job['user_id']
+    message_id = job.get('message_id')
+    operation_name = job['operation_name']
+    start_time = job['submit_time']
+    
+    def edit(text):
+        progress.update(chat_id, message_id, text)
+    
+    edit(
+        "┏━━━━━━━━━━━━━━━━━━━┓\n"
+        "┃ 🎬 **VIDEO YARATILMOQDA** ┃\n"
+        "┗━━━━━━━━━━━━━━━━━━━┛\n\n"
+        "🎨 *Sahna yaratilmoqda...*\n"
+        "🎵 *Audio qo'shilmoqda...*\n\n"
+        "▰▰▰▰▰▰▰▰▰▱ 90%\n\n"
+        "⏳ *2-15 daqiqa kutish...*"
+    )
+    
+    # Har 30 soniyada markaziy ticker yangilaydi (job o'z loop'ini ishlatmaydi)
+    progress.start_ticker(chat_id, message_id, generating_text, start_time)
+    
+    logger.info(f"⏳ WAITING: User {user_id} - kutish boshlandi (operation tracker)")
+    
+    try:
+        # Thread band qilinmaydi - umumiy poller natijani future orqali qaytaradi
+        video_data = await operation_tracker.wait(operation_name, start_time=start_time)
+    finally:
+        progress.stop_ticker(chat_id, message_id)
+    
+    try:
+        if video_data and 'videos' in video_data and len(video_data['videos']) > 0:
+            video_info = video_data['videos'][0]
+            
+            if 'bytesBase64Encoded' in video_info or 'gcsUri' in video_info:
+                logger.info(f"🎉 COMPLETE: User {user_id} - video tayyor!")
+                
+                # LOADING ANIMATSIYA - TUGADI
+                edit(
+                    "┏━━━━━━━━━━━━━━━━━━━┓\n"
+                    "┃ 🎉 **VIDEO TAYYOR!** 🎉 ┃\n"
+                    "┗━━━━━━━━━━━━━━━━━━━┛\n\n"
+                    "✨ *Video tayyorlandi*\n\n"
+                    "▰▰▰▰▰▰▰▰▰▰ 100%\n\n"
+                    "📤 *Yuborilmoqda...*"
+                )
+                
+                # Xotiradan to'g'ridan-to'g'ri yuborish (katta video - vaqtinchalik fayl)
+                async with video_delivery.open(video_info) as video_file:
+                    sent = await bot.send_video(
+                        chat_id=chat_id,
+                        video=video_file,
+                        filename='video.mp4',
+                        caption=build_video_caption(user_id),
+                        supports_streaming=True,
+                        parse_mode='Markdown'
+                    )
+                
+                # Video yaratishni qayd qilish (file_id keyin qayta yuborish uchun)
+                file_id = sent.video.file_id if sent and sent.video else None
+                user_db.record_video_creation(user_id, file_id)
+                if file_id and job.get('result_key'):
+                    video_results.put(job['result_key'], file_id)
+                
+                await job_store.finish(operation_name, 'delivered')
+                
+                progress.delete(chat_id, message_id)
+                
+                logger.info(f"✅ Video sent to user {user_id} - Next video in {VIDEO_COOLDOWN_HOURS} hours")
+                return True
+    except Exception as e:
+        logger.error(f"❌ Delivery error for user {user_id}: {e}")
+    
+    # Agar video yaratish muvaffaqiyatsiz tugasa
+    await job_store.finish(operation_name, 'failed')
+    edit(
+        "❌ **Xatolik**\n\n"
+        "Boshqa rasm yuboring\n\n"
+        "━━━━━━━━━━━━━━━━━━\n"
+        "🤖 @Jonlantir_Ai_bot\n"
+        "━━━━━━━━━━━━━━━━━━"
+    )
+    return False
+
+
+async def resume_generation_job(bot, job):
+    """
+    Resume a job left running by a previous process; it occupies a queue
+    slot and settles the cooldown reservation stored with the job.
+    """
+    ticket = generation_queue.force_acquire()
+    delivered = False
+    try:
+        delivered = await run_generation_job(bot, job)
+    except Exception as e:
+        logger.error(f"❌ Resumed job {job['operation_name']} failed: {e}")
+    finally:
+        generation_queue.release(ticket)
+    # CancelledError (to'xtatilish) bu yerga yetmaydi - job keyingi ishga tushishda davom etadi
+    await user_db.finish_reservation(job['user_id'], job.get('reservation'), delivered)
+    return delivered
+
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler for photo messages - PARALLEL PROCESSING"""
     user = update.effective_user
@@ -1336,11 +4095,32 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_db.add_user(user.id, user.username, user.first_name)
     
     # CHEKLOV TEKSHIRUVI (Admin uchun cheklov yo'q)
-    can_create, time_left = user_db.can_create_video(user.id)
+    # Tekshirish va band qilish atomik - replikalar bir slotni ikki marta bermaydi
+    reservation_status, time_left, reservation = await user_db.reserve_video(user.id)
+    
+    if reservation_status == IN_PROGRESS and update.update_id in replayed_updates:
+        # Crash bo'lgan worker'dan qayta berilgan rasm - slot aynan shu rasm uchun olingan edi
+        if await job_store.has_unfinished(user.id):
+            # Veo job post_init'da davom ettirildi va rezervatsiyani o'zi yakunlaydi
+            logger.info(f"♻️ REPLAY: User {user.id} - job already resumed, update skipped")
+            return
+        reservation_status, time_left, reservation = await user_db.take_over_reservation(user.id)
+    
+    logger.info(f"✅ PARALLEL: User {user.id} reservation={reservation_status}, parallel processing active")
     
-    logger.info(f"✅ PARALLEL: User {user.id} can_create={can_create}, parallel processing active")
+    if reservation_status == IN_PROGRESS:
+        # Bir vaqtda yuborilgan rasmlar uchun qo'shimcha Veo so'rovi yuborilmaydi
+        await update.message.reply_text(
+            "⏳ **Videongiz allaqachon tayyorlanmoqda!**\n\n"
+            "Joriy video tayyor bo'lgach yuboriladi.\n\n"
+            "━━━━━━━━━━━━━━━━━━\n"
+            "🤖 @Jonlantir_Ai_bot\n"
+            "━━━━━━━━━━━━━━━━━━",
+            parse_mode='Markdown'
+        )
+        return
     
-    if not can_create:
+    if reservation_status == COOLDOWN:
         hours = int(time_left // 3600)
         minutes = int((time_left % 3600) // 60)
         
@@ -1359,6 +4139,91 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
+    delivered = False
+    handed_off = False
+    try:
+        delivered = await process_photo(update, context, user, photo, reservation)
+    except asyncio.CancelledError:
+        # To'xtatilish: saqlangan Veo job qayta ishga tushganda rezervatsiyani o'zi yakunlaydi
+        handed_off = await job_store.has_unfinished(user.id)
+        raise
+    finally:
+        # Yetkazilsa cheklov boshlanadi, aks holda slot qaytariladi
+        if not handed_off:
+            await user_db.finish_reservation(user.id, reservation, delivered)
+
+
+class IngestStats:
+    """Bytes the ingest stage moved per pipeline stage versus the full-size baseline"""
+
+    def __init__(self):
+        self.original = {}
+        self.actual = {}
+
+    def record(self, stage, original_bytes, actual_bytes):
+        self.original[stage] = self.original.get(stage, 0) + original_bytes
+        self.actual[stage] = self.actual.get(stage, 0) + actual_bytes
+
+    def saved(self, stage):
+        return self.original.get(stage, 0) - self.actual.get(stage, 0)
+
+    def stats(self):
+        return {stage: self.saved(stage) for stage in self.original}
+
+
+ANALYSIS_MIN_SIDE = int(os.getenv('ANALYSIS_MIN_SIDE', '640'))
+VEO_MAX_SIDE = int(os.getenv('VEO_MAX_SIDE', '1920'))  # Veo 1080p/720p chiqaradi
+ingest_stats = IngestStats()
+
+
+def pick_analysis_size(photo_sizes, min_side):
+    """Smallest Telegram PhotoSize whose long side is at least min_side (largest otherwise)"""
+    for size in sorted(photo_sizes, key=lambda size: size.width * size.height):
+        if max(size.width, size.height) >= min_side:
+            return size
+    return photo_sizes[-1]
+
+
+async def download_photo(bot, photo_size):
+    file = await bot.get_file(photo_size.file_id)
+    # Umumiy async client, event loop bloklanmaydi
+    response = await http_client.get(file.file_path, timeout=20)
+    response.raise_for_status()
+    return response.content
+
+
+def prepare_veo_image(image_bytes, max_side):
+    """Downscale to max_side on the long edge and re-encode as JPEG; small JPEGs pass through"""
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        if max(img.size) <= max_side and img.format == 'JPEG':
+            return image_bytes
+        img.draft('RGB', (max_side, max_side))  # JPEG uchun kichraytirilgan decode
+        img = img.convert('RGB')
+        img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=90)
+        return output.getvalue()
+    except Exception as e:
+        logger.warning(f"⚠️ Veo rendition failed, using original: {e}")
+        return image_bytes
+
+
+async def process_photo(update, context, user, photo, reservation=None):
+    """
+    Analyze the photo and run the Veo job. Returns True once a newly
+    generated video was delivered (the cooldown applies); a free re-send
+    of an earlier video returns False so the reservation is refunded.
+    """
+    # Navbat to'la bo'lsa - darhol va halol javob (rasm yuklanmaydi)
+    priority = GenerationQueue.ADMIN_PRIORITY if user.id in ADMIN_IDS else GenerationQueue.USER_PRIORITY
+    if priority != GenerationQueue.ADMIN_PRIORITY and generation_queue.is_full():
+        await update.message.reply_text(
+            queue_busy_text(generation_queue.estimate_wait(generation_queue.waiting + 1)),
+            parse_mode='Markdown'
+        )
+        return False
+    
     # CHIROYLI LOADING ANIMATSIYA - BOSHLASH
     wait_msg = await update.message.reply_text(
         "┏━━━━━━━━━━━━━━━━━━━┓\n"
@@ -1370,23 +4235,61 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
     
+    # Status tahrirlari kutilmaydi - dispatcher birlashtiradi va limitlaydi
+    def status(text):
+        progress.update(update.effective_chat.id, wait_msg.message_id, text)
+    
     try:
-        # Rasmni yuklash
-        file = await context.bot.get_file(photo.file_id)
-        image_url = file.file_path
-        
         logger.info(f"📥 User {user.id} started video creation")
         
-        # Rasmni yuklab olish
-        session = requests.Session()
-        session.trust_env = False
-        response = session.get(image_url, timeout=20)
-        response.raise_for_status()
-        image_bytes = response.content
+        # Tahlil uchun kichik rendition yetarli - Telegram tayyor o'lchamlaridan olinadi
+        analysis_photo = pick_analysis_size(update.message.photo, ANALYSIS_MIN_SIDE)
+        analysis_bytes = await download_photo(context.bot, analysis_photo)
+        original_size = photo.file_size or 0
+        
+        # Rasmni CHUQUR tahlil qilish (Vision gRPC - batch'ga yig'ilib, alohida thread'da)
+        # Bir xil/forward qilingan rasm uchun natija keshdan olinadi
+        analyzer = image_analyzer
+        # Xesh shu jarayonda: rasmni butunlay worker'ga jo'natish xeshlashdan qimmat
+        content_hash, perceptual_hash = await asyncio.to_thread(image_fingerprint, analysis_bytes)
+        cache_keys = [
+            f"sha:{content_hash}",
+            f"fuid:{photo.file_unique_id}",
+            f"phash:{perceptual_hash}" if perceptual_hash else None
+        ]
         
-        # Rasmni CHUQUR tahlil qilish
-        analyzer = ImageAnalyzer(GOOGLE_SERVICE_ACCOUNT_FILE)
-        analysis = analyzer.analyze_image(image_bytes)
+        async def analyze():
+            ingest_stats.record('vision', original_size, len(analysis_bytes))
+            result = await analyzer.analyze_image(analysis_bytes)
+            if result is None:
+                return None  # Xatolik keshlanmaydi
+            return {'analysis': result, 'content_hash': content_hash}
+        
+        # phash o'xshash rasmni topadi, lekin natija faqat aynan shu baytlar uchun olinadi
+        cached = await analysis_cache.get_or_compute(
+            cache_keys, analyze, accept=lambda value: value['content_hash'] == content_hash
+        )
+        analysis = cached['analysis'] if cached else None
+        
+        # Rasmga mos o'zbek tilida DINAMIK prompt - rasm uchun bir marta tanlanadi, shunda
+        # qayta yuborilgan rasm saqlangan videoning kalitiga to'g'ri keladi
+        selected_style = video_results.style_for(content_hash, lambda: analyzer.generate_uzbek_prompt(analysis))
+        
+        # Shu rasm (aynan shu baytlar) va stsenariy uchun video allaqachon yuborilganmi?
+        if await send_cached_video(context, user.id, content_hash, selected_style):
+            ingest_stats.record('download', original_size, len(analysis_bytes))
+            progress.delete(update.effective_chat.id, wait_msg.message_id)
+            return False
+        
+        # Veo uchun eng katta rendition, lekin Veo chiqish o'lchamidan katta emas
+        if analysis_photo.file_unique_id == photo.file_unique_id:
+            image_bytes = analysis_bytes
+            ingest_stats.record('download', original_size, len(analysis_bytes))
+        else:
+            image_bytes = await download_photo(context.bot, photo)
+            ingest_stats.record('download', original_size, len(analysis_bytes) + len(image_bytes))
+        image_bytes = await image_pool.run(prepare_veo_image, image_bytes, VEO_MAX_SIDE)
+        ingest_stats.record('veo', original_size, len(image_bytes))
         
         # DEBUG LOG
         if analysis:
@@ -1395,236 +4298,115 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.warning(f"⚠️ Analysis failed - using default prompt")
         
         # LOADING ANIMATSIYA - TAHLIL
-        await wait_msg.edit_text(
+        status(
             "┏━━━━━━━━━━━━━━━━━━━┓\n"
             "┃ 🔍 **AI TAHLIL QILMOQDA** ┃\n"
             "┗━━━━━━━━━━━━━━━━━━━┛\n\n"
             "🤖 *Rasm o'rganilmoqda...*\n\n"
             "▰▰▰▰▰▰▱▱▱▱ 60%\n\n"
-            "✨ *Bir daqiqa...*",
-            parse_mode='Markdown'
+            "✨ *Bir daqiqa...*"
         )
         
         # AGAR ESKI/XIRA RASM BO'LSA - YAXSHILASH
-        if analysis and analysis.get('is_old_photo'):
-            await wait_msg.edit_text(
+        if analysis and (analysis.get('is_old_photo') or analysis.get('is_low_quality')):
+            status(
                 "┏━━━━━━━━━━━━━━━━━━━┓\n"
                 "┃ 🎨 **RASM YAXSHILANMOQDA** ┃\n"
                 "┗━━━━━━━━━━━━━━━━━━━┛\n\n"
-                "✨ *Eski rasm aniqlandi*\n"
+                f"✨ *{'Eski' if analysis.get('is_old_photo') else 'Xira'} rasm aniqlandi*\n"
                 "🌈 *Rangli qilinmoqda...*\n\n"
                 "▰▰▰▰▰▰▰▱▱▱ 70%\n\n"
-                "⏳ *Iltimos, kuting...*",
-                parse_mode='Markdown'
+                "⏳ *Iltimos, kuting...*"
             )
             
             # Rasmni yaxshilash
-            image_bytes = analyzer.enhance_old_photo(image_bytes)
+            # CPU og'ir - alohida jarayonda, event loop bloklanmaydi
+            image_bytes = await image_pool.run(ImageAnalyzer.enhance_old_photo, image_bytes)
             logger.info(f"✨ Old photo enhanced for user {user.id}")
         
-        # Rasmga mos o'zbek tilida DINAMIK prompt yaratish
-        selected_style = analyzer.generate_uzbek_prompt(analysis)
-        
         # DEBUG LOG
         logger.info(f"🎭 Selected scenario: {selected_style['name']}")
         logger.info(f"🗣️ Uzbek text: {selected_style.get('uzbek_text', 'N/A')[:50]}")
         
         # LOADING ANIMATSIYA - TAYYOR
-        await wait_msg.edit_text(
+        status(
             "┏━━━━━━━━━━━━━━━━━━━┓\n"
             "┃ ✅ **TAHLIL TUGADI** ┃\n"
             "┗━━━━━━━━━━━━━━━━━━━┛\n\n"
             f"🎭 **{selected_style['name']}**\n"
             f"🗣️ _{selected_style.get('uzbek_text', '')[:45]}_...\n\n"
             "▰▰▰▰▰▰▰▰▱▱ 80%\n\n"
-            "🎬 *Video yaratish boshlandi...*",
-            parse_mode='Markdown'
+            "🎬 *Video yaratish boshlandi...*"
         )
         
         logger.info(f"🎭 SCENARIO: User {user.id} - {selected_style['name']}")
-        logger.info(f"🔄 PARALLEL: User {user.id} video yaratish boshlandi (parallel mode)")
-        
-        # Videoni yaratish (yaxshilangan rasm bilan) - PARALLEL
-        result = veo_generator.create_video_from_image(
-            image_url=None,  # URL o'rniga bytes ishlatamiz
-            prompt=selected_style['prompt'],
-            image_bytes=image_bytes  # Yaxshilangan rasm
-        )
-        
-        logger.info(f"✅ API RESPONSE: User {user.id} - operation started")
-        
-        if not result or 'name' not in result:
-            await wait_msg.edit_text(
-                "❌ **Xatolik**\n\n"
-                "Boshqa rasm yuboring\n\n"
-                "━━━━━━━━━━━━━━━━━━\n"
-                "🤖 @Jonlantir_Ai_bot\n"
-                "━━━━━━━━━━━━━━━━━━",
-                parse_mode='Markdown'
-            )
-            return
-        
-        operation_name = result['name']
-        
-        await wait_msg.edit_text(
-            "┏━━━━━━━━━━━━━━━━━━━┓\n"
-            "┃ 🎬 **VIDEO YARATILMOQDA** ┃\n"
-            "┗━━━━━━━━━━━━━━━━━━━┛\n\n"
-            "🎨 *Sahna yaratilmoqda...*\n"
-            "🎵 *Audio qo'shilmoqda...*\n\n"
-            "▰▰▰▰▰▰▰▰▰▱ 90%\n\n"
-            "⏳ *2-15 daqiqa kutish...*",
-            parse_mode='Markdown'
-        )
-        
-        # Wait for video with progress updates
-        start_time = time.time()
-        last_update_time = start_time
-        video_data = None
-        
-        async def wait_with_updates():
-            nonlocal video_data, last_update_time
-            while True:
-                # Check if video is ready
-                if video_data is None:
-                    # Check status every 2 seconds
-                    await asyncio.sleep(2)
-                    elapsed = int(time.time() - start_time)
-                    
-                    # Update message every 30 seconds
-                    if time.time() - last_update_time > 30:
-                        minutes = elapsed // 60
-                        seconds = elapsed % 60
-                        
-                        # Progress foizini hisoblash (taxminiy)
-                        progress_percent = min(90 + (elapsed // 60), 99)
-                        progress_bar = "▰" * (progress_percent // 10) + "▱" * (10 - progress_percent // 10)
-                        
-                        # Animatsion emoji
-                        animation_frames = ["🎬", "🎨", "🎵", "✨", "🎭", "💫"]
-                        emoji = animation_frames[(elapsed // 30) % len(animation_frames)]
-                        
-                        await wait_msg.edit_text(
-                            "┏━━━━━━━━━━━━━━━━━━━┓\n"
-                            f"┃ {emoji} **VIDEO TAYYORLANMOQDA** {emoji} ┃\n"
-                            "┗━━━━━━━━━━━━━━━━━━━┛\n\n"
-                            f"⏱️ *O'tgan vaqt:* **{minutes}m {seconds}s**\n"
-                            f"📊 *Progress:* {progress_bar} {progress_percent}%\n\n"
-                            "🎨 *AI ishlamoqda...*\n"
-                            "🎵 *Audio qo'shilmoqda...*\n"
-                            "🎬 *Sahna yaratilmoqda...*\n\n"
-                            "⏳ *Iltimos, sabr qiling...*",
-                            parse_mode='Markdown'
-                        )
-                        last_update_time = time.time()
-                else:
-                    break
-        
-        # Start waiting in background
-        update_task = asyncio.create_task(wait_with_updates())
         
-        logger.info(f"⏳ WAITING: User {user.id} - kutish boshlandi (parallel executor)")
+        # Navbat: bir vaqtda ishlaydigan Veo operatsiyalari soni cheklangan
+        def show_position(position, eta):
+            status(queue_position_text(position, eta))
         
-        # PARALLEL PROCESSING - Default executor parallel ishlaydi
-        # Python avtomatik ravishda har bir foydalanuvchi uchun alohida thread yaratadi
-        # None = Default ThreadPoolExecutor (CPU count * 5 threads)
-        
-        # Wait for video (blocking call in thread) - PARALLEL har bir user uchun
-        video_data = await asyncio.get_event_loop().run_in_executor(
-            None,  # Default executor - parallel ishlaydi
-            veo_generator.wait_for_video, 
-            operation_name
-        )
-        
-        logger.info(f"🎉 COMPLETE: User {user.id} - video tayyor!")
-        
-        # Cancel update task
-        update_task.cancel()
         try:
-            await update_task
-        except asyncio.CancelledError:
-            pass
+            ticket = await generation_queue.acquire(priority, on_position=show_position)
+        except GenerationQueueFull as e:
+            logger.warning(f"🚦 SHED: User {user.id} - queue full")
+            status(queue_busy_text(e.eta))
+            return False
         
-        if video_data and 'videos' in video_data and len(video_data['videos']) > 0:
-            video_info = video_data['videos'][0]
+        try:
+            logger.info(f"🔄 PARALLEL: User {user.id} video yaratish boshlandi (parallel mode)")
             
-            if 'bytesBase64Encoded' in video_info:
-                # LOADING ANIMATSIYA - TUGADI
-                await wait_msg.edit_text(
-                    "┏━━━━━━━━━━━━━━━━━━━┓\n"
-                    "┃ 🎉 **VIDEO TAYYOR!** 🎉 ┃\n"
-                    "┗━━━━━━━━━━━━━━━━━━━┛\n\n"
-                    "✨ *Video tayyorlandi*\n\n"
-                    "▰▰▰▰▰▰▰▰▰▰ 100%\n\n"
-                    "📤 *Yuborilmoqda...*",
-                    parse_mode='Markdown'
-                )
-                
-                video_bytes = base64.b64decode(video_info['bytesBase64Encoded'])
-                temp_video_path = f"temp_video_{user.id}_{int(time.time())}.mp4"
-                
-                with open(temp_video_path, 'wb') as f:
-                    f.write(video_bytes)
-                
-                # Video yaratishni qayd qilish
-                user_db.record_video_creation(user.id)
-                
-                # Keyingi video uchun vaqtni hisoblash
-                is_admin = user.id in ADMIN_IDS
-                next_video_time = ""
-                
-                if not is_admin:
-                    next_video_time = f"\n\n⏰ **Keyingi video:** {VIDEO_COOLDOWN_HOURS} soatdan keyin"
-                
-                # CHIROYLI CAPTION BOT LINKI BILAN
-                caption = (
-                    "╔═══════════════════╗\n"
-                    "║ 🎬 **VIDEO TAYYOR!** ║\n"
-                    "╚═══════════════════╝\n\n"
-                    "✅ *Muvaffaqiyatli yaratildi*"
-                    f"{next_video_time}\n\n"
-                    "📸 *Boshqa rasm yuboring!*\n\n"
+            # Videoni yaratish (yaxshilangan rasm bilan) - PARALLEL
+            result = await veo_generator.create_video_from_image(
+                image_url=None,  # URL o'rniga bytes ishlatamiz
+                prompt=selected_style['prompt'],
+                image_bytes=image_bytes  # Yaxshilangan rasm
+            )
+            
+            logger.info(f"✅ API RESPONSE: User {user.id} - operation started")
+            
+            if not result or 'name' not in result:
+                generation_queue.release(ticket, completed=False)
+                ticket = None
+                status(
+                    "❌ **Xatolik**\n\n"
+                    "Boshqa rasm yuboring\n\n"
                     "━━━━━━━━━━━━━━━━━━\n"
                     "🤖 @Jonlantir_Ai_bot\n"
                     "━━━━━━━━━━━━━━━━━━"
                 )
-                
-                with open(temp_video_path, 'rb') as video_file:
-                    await context.bot.send_video(
-                        chat_id=user.id,
-                        video=video_file,
-                        caption=caption,
-                        supports_streaming=True,
-                        parse_mode='Markdown'
-                    )
-                
-                # Tozalash
-                os.remove(temp_video_path)
-                await wait_msg.delete()
-                
-                logger.info(f"✅ Video sent to user {user.id} - Next video in {VIDEO_COOLDOWN_HOURS} hours")
-                return
-        
-        # Agar video yaratish muvaffaqiyatsiz tugasa
-        await wait_msg.edit_text(
-            "❌ **Xatolik**\n\n"
-            "Boshqa rasm yuboring\n\n"
-            "━━━━━━━━━━━━━━━━━━\n"
-            "🤖 @Jonlantir_Ai_bot\n"
-            "━━━━━━━━━━━━━━━━━━",
-            parse_mode='Markdown'
-        )
+                return False
+            
+            operation_name = result['name']
+            
+            # Operatsiyani diskka yozamiz - restart/redeploy'da yo'qolmasin
+            job = {
+                'operation_name': operation_name,
+                'chat_id': update.effective_chat.id,
+                'user_id': user.id,
+                'message_id': wait_msg.message_id,
+                'model': model_from_operation(operation_name),
+                'submit_time': time.time(),
+                'result_key': VideoResultStore.make_key(content_hash, selected_style['name'], selected_style['prompt']),
+                # Restart'dan keyin davom ettirilgan job rezervatsiyani o'zi yakunlaydi
+                'reservation': reservation
+            }
+            await job_store.add(job)
+            
+            return await run_generation_job(context.bot, job)
+        finally:
+            if ticket:
+                generation_queue.release(ticket)
         
     except Exception as e:
         logger.error(f"❌ Error for user {user.id}: {e}")
-        await wait_msg.edit_text(
+        status(
             "❌ **Xatolik**\n\n"
             "Boshqa rasm yuboring\n\n"
             "━━━━━━━━━━━━━━━━━━\n"
             "🤖 @Jonlantir_Ai_bot\n"
-            "━━━━━━━━━━━━━━━━━━",
-            parse_mode='Markdown'
+            "━━━━━━━━━━━━━━━━━━"
         )
+        return False
 
 
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1642,13 +4424,14 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Statistikani olish
     stats = user_db.get_all_stats()
+    cache_stats = analysis_cache.stats()
+    ingest_saved = ingest_stats.stats()
+    vision_saved = vision_stats.stats()
+    no_faces = vision_saved.get('no_faces', {})
+    with_faces = vision_saved.get('faces', {})
     
     # Eng faol foydalanuvchilar
-    top_users = sorted(
-        user_db.data.items(),
-        key=lambda x: x[1].get('videos_created', 0),
-        reverse=True
-    )[:10]
+    top_users = user_db.get_top_users(10)
     
     admin_text = (
         "┏━━━━━━━━━━━━━━━━━┓\n"
@@ -1657,12 +4440,23 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         f"👥 Userlar: **{stats['total_users']}**\n"
         f"🎬 Videolar: **{stats['total_videos']}**\n"
-        f"✅ Bugun: **{stats['active_today']}**\n\n"
+        f"✅ Bugun: **{stats['active_today']}**\n"
+        f"🗂 Kesh: **{cache_stats['memory_hits'] + cache_stats['disk_hits']}** hit / "
+        f"**{cache_stats['misses']}** miss ({cache_stats['hit_rate']:.0%})\n"
+        f"📉 Tejaldi: yuklash **{ingest_saved.get('download', 0) / 1e6:.1f}** MB, "
+        f"Vision **{ingest_saved.get('vision', 0) / 1e6:.1f}** MB, "
+        f"Veo **{ingest_saved.get('veo', 0) / 1e6:.1f}** MB\n"
+        f"👁 Vision: yuzsiz **{no_faces.get('photos', 0)}** rasm, "
+        f"**{no_faces.get('features_avoided', 0)}** label so'rovi tejaldi; "
+        f"yuzli **{with_faces.get('photos', 0)}** rasm, "
+        f"+**{-with_faces.get('rpcs_avoided', 0)}** RPC "
+        f"(+{-with_faces.get('bytes_avoided', 0) / 1e6:.1f} MB)\n\n"
         
         "🏆 **TOP 10:**\n"
     )
     
-    for i, (user_id, user_data) in enumerate(top_users, 1):
+    for i, user_data in enumerate(top_users, 1):
+        user_id = user_data.get('user_id')
         username = user_data.get('username') or 'username_yoq'
         first_name = user_data.get('first_name', 'Noma\'lum')
         videos = user_data.get('videos_created', 0)
@@ -1672,6 +4466,30 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             admin_text += f"{i}. {first_name} (ID: {user_id}) - {videos} video\n"
     
+    # Navbat holati
+    queue_stats = generation_queue.stats()
+    admin_text += (
+        f"\n🚦 Navbat: **{queue_stats['in_flight']}/{queue_stats['max_in_flight']}** ishlamoqda, "
+        f"**{queue_stats['waiting']}** kutmoqda (~{int(queue_stats['avg_duration'])}s/video)\n"
+    )
+    
+    # Veo modellari holati (circuit breaker)
+    admin_text += "\n🧠 **MODELLAR:**\n"
+    state_icons = {
+        ModelHealthTracker.CLOSED: "✅",
+        ModelHealthTracker.HALF_OPEN: "🟡",
+        ModelHealthTracker.OPEN: "⛔"
+    }
+    for model in veo_generator.health.snapshot(GoogleVeoVideoGenerator.VEO_MODELS):
+        line = f"{state_icons[model['state']]} `{model['model']}`"
+        if model['open_for']:
+            line += f" - {model['open_for'] // 60}m {model['open_for'] % 60}s"
+        if model['last_status'] is not None:
+            line += f" | {model['last_status']}"
+        if model['median_latency'] is not None:
+            line += f" | {model['median_latency']:.1f}s"
+        admin_text += line + "\n"
+    
     admin_text += (
         "\n━━━━━━━━━━━━━━━━━━\n"
         "🤖 @Jonlantir_Ai_bot\n"
@@ -1693,7 +4511,7 @@ async def my_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Keyingi video vaqti
-    can_create, time_left = user_db.can_create_video(user.id)
+    can_create, time_left = await user_db.cooldown_left(user.id)
     
     is_admin = user.id in ADMIN_IDS
     status = "👑 **ADMIN** (Cheklovsiz)" if is_admin else "👤 **Oddiy foydalanuvchi**"
@@ -1727,6 +4545,38 @@ async def my_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(stats_text, parse_mode='Markdown')
 
 
+async def last_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Oxirgi videoni qayta yuborish - qayta yaratmasdan (file_id orqali)"""
+    user = update.effective_user
+    
+    stats = user_db.get_user_stats(user.id)
+    file_id = stats.get('last_video_file_id') if stats else None
+    
+    if not file_id:
+        await update.message.reply_text(
+            "📭 **Hali video yo'q**\n\n"
+            "📸 Rasm yuboring - AI uni jonli videoga aylantiradi\n\n"
+            "━━━━━━━━━━━━━━━━━━\n"
+            "🤖 @Jonlantir_Ai_bot\n"
+            "━━━━━━━━━━━━━━━━━━",
+            parse_mode='Markdown'
+        )
+        return
+    
+    await context.bot.send_video(
+        chat_id=user.id,
+        video=file_id,
+        caption=(
+            "🎬 **Oxirgi videongiz**\n\n"
+            "━━━━━━━━━━━━━━━━━━\n"
+            "🤖 @Jonlantir_Ai_bot\n"
+            "━━━━━━━━━━━━━━━━━━"
+        ),
+        supports_streaming=True,
+        parse_mode='Markdown'
+    )
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler for /help command"""
     help_text = (
@@ -1740,7 +4590,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "👴 Bobo | 👵 Buvi | 👨 Ota\n"
         "💕 Ona | 👦 Bola | 👥 Oila\n\n"
         
-        "⏰ Har 6 soatda 1 video\n\n"
+        "⏰ Har 6 soatda 1 video\n"
+        "🔁 /last — oxirgi videoni qayta olish\n\n"
         
         "━━━━━━━━━━━━━━━━━━\n"
         "🤖 @Jonlantir_Ai_bot\n"
@@ -1803,8 +4654,461 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         pass
 
 
+class WebhookServer:
+    """
+    Minimal asyncio HTTP/1.1 server for Telegram webhooks.
+    POST <path> with the right secret token header hands the Update to the
+    application's update processor. Once max_pending accepted updates are
+    still being handled it answers 503, so Telegram retries later instead of
+    us piling up unbounded handler tasks. GET /health answers the platform's
+    probes.
+    """
+
+    REASONS = {
+        200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+        405: 'Method Not Allowed', 413: 'Payload Too Large', 503: 'Service Unavailable'
+    }
+
+    def __init__(self, application, path, secret_token, max_pending=1000,
+                 max_body=1024 * 1024, idle_timeout=75):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.max_pending = max_pending
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self._server = None
+        # Qabul qilingan, handler'i hali tugamagan update'lar. update_queue.qsize() yaramaydi:
+        # concurrent_updates rejimida PTB har bir update'ni darhol navbatdan task'ga oladi
+        self.in_flight = 0
+        self.counters = {'accepted': 0, 'rejected': 0, 'forbidden': 0, 'invalid': 0}
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        logger.info(f"🌐 Webhook server listening on {host}:{port}{self.path}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader):
+        """Returns (method, path, headers, body) or None when the client went away"""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=self.idle_timeout)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            return None
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > self.max_body:
+            return method, target.split('?', 1)[0], headers, None
+        body = await asyncio.wait_for(reader.readexactly(length), timeout=30) if length else b''
+        return method, target.split('?', 1)[0], headers, body
+
+    def _dispatch(self, method, path, headers, body):
+        if path == '/health':
+            if method != 'GET':
+                return 405, {'ok': False}
+            running = self.application.running
+            return (200 if running else 503), {
+                'ok': running,
+                'pending': self.in_flight,
+                **self.counters
+            }
+        if path != self.path:
+            return 404, {'ok': False}
+        if method != 'POST':
+            return 405, {'ok': False}
+        
+        received = headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+            self.counters['forbidden'] += 1
+            return 403, {'ok': False}
+        if body is None:
+            return 413, {'ok': False}
+        
+        # Ishlov to'la (yoki bot to'xtayapti) - Telegram keyinroq qayta yuboradi
+        if self.in_flight >= self.max_pending or not self.application.running:
+            self.counters['rejected'] += 1
+            return 503, {'ok': False}
+        
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception as e:
+            self.counters['invalid'] += 1
+            logger.warning(f"⚠️ Invalid webhook payload: {e}")
+            return 400, {'ok': False}
+        self.in_flight += 1
+        spawn_background(self._process(update))
+        self.counters['accepted'] += 1
+        return 200, {'ok': True}
+
+    async def _process(self, update):
+        """Run the handlers like PTB's update fetcher would, and free the slot when they finish"""
+        try:
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update)
+            )
+        except Exception as e:
+            logger.error(f"Webhook update {update.update_id} failed: {e}")
+        finally:
+            self.in_flight -= 1
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = self._dispatch(method, path, headers, body)
+                keep_alive = headers.get('connection', '').lower() != 'close' and body is not None
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {self.REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"Webhook connection error: {e}")
+        finally:
+            writer.close()
+
+
+async def run_webhook(application: Application):
+    """Serve updates through a webhook instead of long polling"""
+    secret_token = WEBHOOK_SECRET
+    if not secret_token:
+        # Bitta replika uchun yetarli; bir nechta replikada WEBHOOK_SECRET bir xil bo'lishi kerak
+        secret_token = secrets.token_urlsafe(32)
+        logger.warning("⚠️ WEBHOOK_SECRET not set - using a random secret for this process")
+    
+    server = WebhookServer(application, WEBHOOK_PATH, secret_token, max_pending=WEBHOOK_MAX_PENDING)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows
+    
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start('0.0.0.0', WEBHOOK_PORT)
+        await application.start()
+        
+        # Restart paytida yuborilgan rasmlar Telegram tomonida saqlanib qoladi
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=DROP_PENDING_UPDATES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"✅ Webhook set: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
+
+async def post_init(application: Application):
+    """Runs inside the bot's event loop before polling starts"""
+    # Rasm worker'lari spawn qilinadi; import tugashini loop bloklanmasdan kutadi
+    await image_pool.start()
+    
+    print("🔍 Ulanish tekshirilmoqda...")
+    token = await veo_generator.get_access_token()
+    if not token:
+        print("❌ Ulanish xatosi!")
+        raise RuntimeError("Google Cloud access token could not be obtained")
+    print("✅ Ulanish muvaffaqiyatli!")
+    
+    # Token fon rejimida yangilanadi, Vision client oldindan isitiladi
+    google_credentials.start()
+    await asyncio.to_thread(google_credentials.vision_client)
+    
+    # Status xabarlari uchun yagona dispatcher
+    progress.start(application.bot)
+    
+    # Oldingi ishga tushirishdan qolgan vaqtinchalik videolarni tozalash
+    await asyncio.to_thread(video_delivery.cleanup_stale)
+    
+    # Restart/redeploy paytida tugallanmagan videolarni davom ettirish
+    await job_store.compact()
+    unfinished_jobs = [job for job in await job_store.unfinished() if owns_user(job['user_id'])]
+    for job in unfinished_jobs:
+        spawn_background(resume_generation_job(application.bot, job))
+    if unfinished_jobs:
+        print(f"♻️ Tugallanmagan {len(unfinished_jobs)} ta video davom ettirilmoqda")
+    spawn_background(job_store.run_compactor())
+    if isinstance(user_db.backend, JournaledUserBackend):
+        spawn_background(user_db.backend.run_compactor())
+
+
+async def post_shutdown(application: Application):
+    """Release pooled connections on shutdown"""
+    for task in list(background_tasks):
+        task.cancel()
+    await progress.stop()
+    image_pool.shutdown()
+    vision_batcher.shutdown()
+    await user_db.cooldowns.close()
+    if isinstance(user_db.backend, JournaledUserBackend):
+        user_db.backend.close()
+    await google_credentials.stop()
+    await http_client.aclose()
+
+
+def build_application(updater=True):
+    """Application with all bot handlers registered"""
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(True)  # Parallel updates
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
+    
+    # Add handlers
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("scenarios", scenarios_command))
+    application.add_handler(CommandHandler("admin", admin_panel))
+    application.add_handler(CommandHandler("stats", my_stats))
+    application.add_handler(CommandHandler("last", last_video))
+    application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    
+    # Error handler
+    application.add_error_handler(error_handler)
+    return application
+
+
+# Worker jarayonida (index, workers); bitta jarayonli rejimda None
+worker_shard = None
+# O'lgan worker'dan qayta berilgan update_id'lar (shu worker jarayonida)
+replayed_updates = set()
+
+
+def shard_for(user_id, workers):
+    return user_id % workers
+
+
+def owns_user(user_id):
+    """Whether this process handles the given user (always true without workers)"""
+    return worker_shard is None or shard_for(user_id, worker_shard[1]) == worker_shard[0]
+
+
+class WorkerPool:
+    """
+    Front-process side of the multi-process mode.
+    Each update goes to the worker owning its user (user_id % N) through a
+    local multiprocessing queue, so a user's updates stay ordered and hit
+    the same cooldown/queue state. Updates stay unacked until the worker has
+    processed them; a crashed worker is restarted and gets its unacked
+    updates again.
+    """
+
+    def __init__(self, workers, check_interval=1.0):
+        self.workers = workers
+        self.check_interval = check_interval
+        self.ctx = multiprocessing.get_context('spawn')
+        self.acks = self.ctx.Queue()
+        self.queues = [None] * workers
+        self.processes = [None] * workers
+        self.unacked = [OrderedDict() for _ in range(workers)]
+        self.restarts = 0
+
+    def _spawn(self, index):
+        updates = self.ctx.Queue()
+        process = self.ctx.Process(
+            target=worker_main,
+            args=(index, self.workers, updates, self.acks),
+            name=f"bot-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self.queues[index] = updates
+        self.processes[index] = process
+        # Tasdiqlanmagan update'lar yangi worker'ga qayta beriladi (replay belgisi bilan)
+        for data in self.unacked[index].values():
+            updates.put((data, True))
+        logger.info(f"👷 Worker {index} started (pid {process.pid}, {len(self.unacked[index])} replayed)")
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def shard(self, update):
+        if update.effective_user:
+            key = update.effective_user.id
+        elif update.effective_chat:
+            key = update.effective_chat.id
+        else:
+            key = update.update_id
+        return shard_for(key, self.workers)
+
+    def submit(self, update):
+        index = self.shard(update)
+        data = update.to_dict()
+        self.unacked[index][update.update_id] = data
+        self.queues[index].put((data, False))
+
+    def _drain_acks(self):
+        while True:
+            try:
+                index, update_id = self.acks.get_nowait()
+            except queue.Empty:
+                return
+            self.unacked[index].pop(update_id, None)
+
+    async def supervise(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                self._drain_acks()
+                for index, process in enumerate(self.processes):
+                    if process is not None and not process.is_alive():
+                        self.restarts += 1
+                        logger.error(f"💥 Worker {index} died (exit code {process.exitcode}) - restarting")
+                        self.queues[index].cancel_join_thread()
+                        self._drain_acks()
+                        self._spawn(index)
+            except Exception as e:
+                logger.error(f"Worker supervisor error: {e}")
+
+    def stop(self, timeout=30):
+        for updates in self.queues:
+            if updates is not None:
+                updates.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+
+
+def worker_main(index, workers, updates, acks):
+    """Entry point of a worker process (spawned, so module state is fresh)"""
+    try:
+        asyncio.run(run_worker(index, workers, updates, acks))
+    except KeyboardInterrupt:
+        pass
+
+
+async def run_worker(index, workers, updates, acks, max_concurrent=256):
+    """Process the updates of one user shard until the front sends None"""
+    global worker_shard
+    worker_shard = (index, workers)
+    
+    # Umumiy limitlar worker'lar orasida bo'linadi
+    generation_queue.max_in_flight = max(1, VEO_MAX_IN_FLIGHT // workers)
+    progress.global_bucket = TokenBucket(PROGRESS_GLOBAL_RATE / workers, PROGRESS_GLOBAL_RATE / workers)
+    
+    # Har bir worker o'z ulanishlarini ochadi; migratsiyani front allaqachon bajargan
+    init_storage()
+    application = build_application(updater=False)
+    semaphore = asyncio.Semaphore(max_concurrent)
+    
+    async def process(update):
+        try:
+            await application.process_update(update)
+        finally:
+            replayed_updates.discard(update.update_id)
+            semaphore.release()
+            acks.put((index, update.update_id))
+    
+    await application.initialize()
+    try:
+        await application.post_init(application)
+        await application.start()
+        while True:
+            item = await asyncio.to_thread(updates.get)
+            if item is None:
+                break
+            data, replayed = item
+            update = Update.de_json(data, application.bot)
+            if replayed:
+                replayed_updates.add(update.update_id)
+            await semaphore.acquire()
+            spawn_background(process(update))
+        
+        # Ishlayotgan update'lar tugashini kutamiz
+        for _ in range(max_concurrent):
+            await semaphore.acquire()
+    finally:
+        if application.running:
+            await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+
+
+worker_pool = None
+
+
+async def route_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Front process: hand the update to the worker owning its user"""
+    worker_pool.submit(update)
+
+
+async def front_post_init(application: Application):
+    worker_pool.start()
+    spawn_background(worker_pool.supervise())
+
+
+async def front_post_shutdown(application: Application):
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.to_thread(worker_pool.stop)
+
+
+def build_front_application():
+    """Front process: receives updates and routes them, no bot logic"""
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_init(front_post_init)
+        .post_shutdown(front_post_shutdown)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, route_update))
+    return application
+
+
 def main():
     """Start the bot"""
+    global worker_pool
+    
+    write_service_account_file()
+    
     if not TELEGRAM_BOT_TOKEN:
         print("❌ TELEGRAM_BOT_TOKEN not set!")
         return
@@ -1817,43 +5121,32 @@ def main():
         print(f"❌ {GOOGLE_SERVICE_ACCOUNT_FILE} not found!")
         return
     
+    if BOT_WORKERS > 1 and USER_DB_BACKEND != 'sqlite':
+        print("❌ BOT_WORKERS requires USER_DB_BACKEND=sqlite (shared between processes)!")
+        return
+    
     # Clean proxy settings
     for var in ['HTTP_PROXY', 'HTTPS_PROXY', 'http_proxy', 'https_proxy']:
         os.environ.pop(var, None)
     
-    print("🔍 Ulanish tekshirilmoqda...")
-    token = veo_generator.get_access_token()
-    if not token:
-        print("❌ Ulanish xatosi!")
-        return
-    print("✅ Ulanish muvaffaqiyatli!")
+    # Baza va JSON migratsiyasi faqat shu (ota) jarayonda, worker'lar spawn qilinishidan oldin
+    init_storage(migrate=True)
     
     try:
         # PARALLEL PROCESSING - Ko'p foydalanuvchilar uchun optimallashtirilgan
-        application = (
-            Application.builder()
-            .token(TELEGRAM_BOT_TOKEN)
-            .concurrent_updates(True)  # Parallel updates
-            .build()
-        )
-        
-        # Add handlers
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("scenarios", scenarios_command))
-        application.add_handler(CommandHandler("admin", admin_panel))
-        application.add_handler(CommandHandler("stats", my_stats))
-        application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-        
-        # Error handler
-        application.add_error_handler(error_handler)
+        if BOT_WORKERS > 1:
+            worker_pool = WorkerPool(BOT_WORKERS)
+            application = build_front_application()
+        else:
+            application = build_application()
         
         print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
         print("🚀 JONLANTIR AI BOT ISHGA TUSHDI!")
         print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
         print(f"👑 Adminlar: {len(ADMIN_IDS)} ta")
         print("⚡ Parallel: Bir vaqtda ko'p user")
+        if BOT_WORKERS > 1:
+            print(f"👷 Worker jarayonlar: {BOT_WORKERS} ta")
         print("⏰ Cheklov: 6 soatda 1 video")
         print("🎭 Stsenariylar: 200+ variant")
         print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
@@ -1861,11 +5154,18 @@ def main():
         print("🔴 To'xtatish: Ctrl+C")
         print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
         
-        # PARALLEL PROCESSING - Ko'p foydalanuvchilar uchun
-        application.run_polling(
-            drop_pending_updates=True,
-            allowed_updates=Update.ALL_TYPES
-        )
+        if BOT_MODE == 'webhook':
+            if not WEBHOOK_URL:
+                print("❌ BOT_MODE=webhook requires WEBHOOK_URL!")
+                return
+            print(f"🌐 Webhook rejimi: port {WEBHOOK_PORT}")
+            asyncio.run(run_webhook(application))
+        else:
+            # PARALLEL PROCESSING - Ko'p foydalanuvchilar uchun
+            application.run_polling(
+                drop_pending_updates=DROP_PENDING_UPDATES,
+                allowed_updates=Update.ALL_TYPES
+            )
         
     except KeyboardInterrupt:
         print("\n🛑 Bot to'xtatildi.")
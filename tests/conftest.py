@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# bot.py import paytida yaratadigan fayllar (sqlite, jurnal) repo ichida qolmasin
+os.chdir(tempfile.mkdtemp(prefix='jonlantir-tests-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
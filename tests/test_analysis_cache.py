@@ -0,0 +1,66 @@
+import asyncio
+
+from bot import AnalysisCache
+
+
+def test_perceptual_hit_for_other_bytes_is_not_reused():
+    async def scenario():
+        cache = AnalysisCache()
+        await cache.put(['sha:a', 'phash:ffff'], {'content_hash': 'a', 'analysis': 'A'})
+        
+        async def compute():
+            return {'content_hash': 'b', 'analysis': 'B'}
+        
+        value = await cache.get_or_compute(
+            ['sha:b', 'phash:ffff'], compute, accept=lambda value: value['content_hash'] == 'b'
+        )
+        return cache, value
+    
+    cache, value = asyncio.run(scenario())
+    assert value['analysis'] == 'B'
+    assert cache.counters['near_duplicates'] == 1
+
+
+def test_exact_hit_is_reused():
+    async def scenario():
+        cache = AnalysisCache()
+        await cache.put(['sha:a', 'phash:ffff'], {'content_hash': 'a', 'analysis': 'A'})
+        
+        async def compute():
+            raise AssertionError('must not recompute')
+        
+        return await cache.get_or_compute(
+            ['sha:a', 'phash:ffff'], compute, accept=lambda value: value['content_hash'] == 'a'
+        )
+    
+    assert asyncio.run(scenario())['analysis'] == 'A'
+
+
+def test_cancelled_leader_does_not_strand_waiters():
+    async def scenario():
+        cache = AnalysisCache()
+        started = asyncio.Event()
+        
+        async def slow():
+            started.set()
+            await asyncio.sleep(60)
+        
+        async def fast():
+            return {'content_hash': 'a'}
+        
+        leader = asyncio.create_task(cache.get_or_compute(['sha:a'], slow))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get_or_compute(['sha:a'], fast))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await asyncio.wait_for(waiter, 5)
+    
+    assert asyncio.run(scenario()) == {'content_hash': 'a'}
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    async def scenario():
+        await AnalysisCache(disk_dir=str(tmp_path)).put(['sha:a'], {'content_hash': 'a'})
+        return await AnalysisCache(disk_dir=str(tmp_path)).get('sha:a')
+    
+    assert asyncio.run(scenario()) == {'content_hash': 'a'}
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from bot import ImageAnalyzer
+
+
+def synthetic(kind, seed=0):
+    rng = np.random.default_rng(seed)
+    if kind == 'noise':
+        pixels = rng.integers(0, 256, (300, 400, 3), dtype=np.uint8)
+        return Image.fromarray(pixels)
+    if kind == 'sepia':
+        ramp = np.linspace(0, 255, 400)[None, :, None] * np.ones((300, 1, 3))
+        pixels = np.clip(ramp * np.array([1.0, 0.85, 0.65]) + 40, 0, 255).astype(np.uint8)
+        return Image.fromarray(pixels).filter(ImageFilter.GaussianBlur(2))
+    pixels = np.clip(rng.normal(128, 60, (300, 400, 3)), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels).filter(ImageFilter.GaussianBlur(3))
+
+
+@pytest.mark.parametrize('kind', ['noise', 'sepia', 'colour'])
+@pytest.mark.parametrize('strip_rows', [64, 256])
+def test_fused_enhancement_matches_the_enhancer_chain(kind, strip_rows):
+    img = synthetic(kind)
+    chain = np.asarray(ImageAnalyzer._enhance_chain(img), dtype=np.int16)
+    fused = np.asarray(ImageAnalyzer._enhance_fused(img, strip_rows=strip_rows), dtype=np.int16)
+    
+    # Bosqichlar orasida 0..255 ga qirqiladi - natija aynan bir xil
+    assert np.abs(chain - fused).max() == 0
@@ -0,0 +1,61 @@
+import asyncio
+import io
+import os
+import time
+
+from PIL import Image
+
+from bot import ImageWorkerPool, prepare_veo_image
+
+
+def crash_once(marker):
+    # Birinchi chaqiruvda worker o'ladi (BrokenProcessPool), keyingisida ishlaydi
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return os.getpid()
+
+
+def jpeg_bytes(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (120, 90, 60)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def test_pool_starts_without_blocking_the_loop_and_runs_stages():
+    pool = ImageWorkerPool(1)
+    
+    async def scenario():
+        lags = []
+        
+        async def ticker():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - started - 0.01)
+        
+        tick = asyncio.create_task(ticker())
+        try:
+            await pool.start()
+            resized = await pool.run(prepare_veo_image, jpeg_bytes(2400, 1600), 1280)
+        finally:
+            tick.cancel()
+            pool.shutdown()
+        return lags, resized
+    
+    lags, resized = asyncio.run(scenario())
+    # Worker import qilinayotganda ham loop ishlashda davom etadi
+    assert len(lags) > 5 and max(lags) < 0.25
+    assert max(Image.open(io.BytesIO(resized)).size) <= 1280
+
+
+def test_broken_pool_is_recreated_once(tmp_path):
+    pool = ImageWorkerPool(1)
+    
+    async def scenario():
+        try:
+            return await pool.run(crash_once, str(tmp_path / 'crashed'))
+        finally:
+            pool.shutdown()
+    
+    assert asyncio.run(scenario()) != os.getpid()
@@ -0,0 +1,60 @@
+import asyncio
+import contextlib
+import io
+import time
+
+from PIL import Image
+
+from bot import GoogleVeoVideoGenerator, ModelHealthTracker
+
+
+def test_breaker_opens_after_threshold_and_probes_once():
+    health = ModelHealthTracker(failure_threshold=2, cooloff=60)
+    health.record('veo', 503, 0.1)
+    health.record('veo', 503, 0.1)
+    assert not health.allow('veo')
+    
+    health.models['veo']['open_until'] = time.time() - 1
+    assert health.allow('veo')
+    assert not health.allow('veo')  # Bitta probe
+    health.record('veo', 200, 0.1)
+    assert health.allow('veo')
+
+
+def test_cancelled_probe_releases_the_slot():
+    health = ModelHealthTracker(failure_threshold=1, cooloff=60)
+    health.record('veo', 503, 0.1)
+    health.models['veo']['open_until'] = time.time() - 1
+    assert health.allow('veo')
+    
+    health.release_probe('veo')  # Probe hech narsa yozmasdan tugadi
+    assert health.allow('veo')
+
+
+def test_cancelled_request_does_not_wedge_the_probe():
+    class Credentials:
+        async def get_token(self):
+            return 'token'
+    
+    class HangingHttp:
+        async def post(self, *args, **kwargs):
+            await asyncio.sleep(60)
+    
+    health = ModelHealthTracker(failure_threshold=1, cooloff=60)
+    model_id = GoogleVeoVideoGenerator.VEO_MODELS[0]
+    health.record(model_id, 503, 0.1)
+    health.models[model_id]['open_until'] = time.time() - 1
+    generator = GoogleVeoVideoGenerator('project', 'us-central1', Credentials(), HangingHttp(), health=health)
+    
+    image = io.BytesIO()
+    Image.new('RGB', (32, 32)).save(image, 'JPEG')
+    
+    async def scenario():
+        task = asyncio.create_task(generator.create_video_from_image(image_bytes=image.getvalue()))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    
+    asyncio.run(scenario())
+    assert health.allow(model_id)
@@ -0,0 +1,84 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from bot import photo_properties
+
+
+def png_bytes(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def luminance_ramp(low=10, high=245, size=(160, 240)):
+    height, width = size
+    ramp = np.linspace(low, high, width)[None, :] * np.ones((height, 1))
+    return ramp[..., None]
+
+
+def grayscale_photo():
+    return png_bytes(luminance_ramp() * np.ones(3))
+
+
+def sepia_photo():
+    # Klassik sepia tonlash: yorqinlik x bitta iliq rang
+    return png_bytes(luminance_ramp() * np.array([1.0, 0.88, 0.72]))
+
+
+def warm_modern_photo():
+    # Chiroq ostidagi xona: bej devor, teri, yog'och mebel, och parda - hammasi iliq
+    rng = np.random.default_rng(3)
+    blocks = [(200, 175, 150), (200, 175, 150), (210, 165, 135), (130, 95, 65), (235, 220, 200)]
+    pixels = np.concatenate([np.full((32, 240, 3), color, dtype=np.float64) for color in blocks])
+    return png_bytes(pixels + rng.normal(0, 3, pixels.shape))
+
+
+def colourful_photo():
+    blocks = [(220, 40, 40), (40, 160, 60), (30, 60, 200), (240, 240, 240), (20, 20, 20)]
+    return png_bytes(np.concatenate([np.full((32, 240, 3), color, dtype=np.float64) for color in blocks]))
+
+
+def washed_out_photo():
+    blocks = [(150, 120, 120), (120, 150, 125), (120, 125, 155)]
+    return png_bytes(np.concatenate([np.full((50, 240, 3), color, dtype=np.float64) for color in blocks]))
+
+
+@pytest.mark.parametrize('make, grayscale, sepia, old, low_quality', [
+    (grayscale_photo, True, False, True, False),
+    (sepia_photo, False, True, True, False),
+    (warm_modern_photo, False, False, False, False),
+    (colourful_photo, False, False, False, False),
+    (washed_out_photo, False, False, False, True),
+])
+def test_photo_age_signals(make, grayscale, sepia, old, low_quality):
+    properties = photo_properties(make())
+    
+    assert properties['grayscale'] == grayscale
+    assert properties['sepia'] == sepia
+    assert properties['is_old_photo'] == old
+    assert properties['is_low_quality'] == low_quality
+
+
+def test_warm_modern_photo_would_have_passed_the_loose_sepia_rule():
+    # Eski qoida (warm_ratio > 0.85, mean_sat < 0.35) bu rasmni sepia deb belgilardi
+    properties = photo_properties(warm_modern_photo())
+    pixels = np.asarray(Image.open(io.BytesIO(warm_modern_photo())), dtype=np.float32).reshape(-1, 3)
+    warm_ratio = ((pixels[:, 0] >= pixels[:, 1]) & (pixels[:, 1] >= pixels[:, 2])).mean()
+    
+    assert warm_ratio > 0.85 and properties['mean_saturation'] < 0.35
+    assert not properties['sepia']
+
+
+def test_dominant_colours_and_determinism():
+    image_bytes = colourful_photo()
+    properties = photo_properties(image_bytes)
+    
+    colours = properties['dominant_colors']
+    assert len(colours) == 3
+    assert [c['score'] for c in colours] == sorted((c['score'] for c in colours), reverse=True)
+    assert sum(c['score'] for c in colours) == pytest.approx(1.0)
+    assert sum(properties['saturation_histogram']) == pytest.approx(1.0, abs=1e-3)
+    assert photo_properties(image_bytes) == properties
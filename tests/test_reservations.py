@@ -0,0 +1,123 @@
+import asyncio
+import base64
+import multiprocessing
+import os
+import time
+
+import pytest
+
+import bot
+from bot import (COOLDOWN, IN_PROGRESS, RESERVED, JobStore, JsonUserBackend, MemoryCooldownStore,
+                 SqliteCooldownStore, UserDatabase)
+
+USERS = 40
+PROCESSES = 8
+
+
+def reserve_all(db_file, barrier, results):
+    store = SqliteCooldownStore(db_file, cooldown=3600, hold=600)
+    barrier.wait()
+    granted = []
+    for user_id in range(1, USERS + 1):
+        status, _, token = asyncio.run(store.reserve(user_id))
+        if status == RESERVED:
+            granted.append((user_id, token))
+    results.put(granted)
+
+
+def list_files(results):
+    # Test moduli (va u bilan bot.py) spawn qilingan jarayonda import qilingan
+    results.put(sorted(os.listdir('.')))
+
+
+def test_spawned_import_has_no_file_side_effects(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('SERVICE_ACCOUNT_JSON_BASE64', base64.b64encode(b'{}').decode())
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=list_files, args=(results,))
+    process.start()
+    files = results.get(timeout=120)
+    process.join(30)
+    
+    # service-account.json, sqlite va JSON migratsiyasi faqat main() da
+    assert process.exitcode == 0
+    assert files == []
+
+
+@pytest.mark.parametrize('make_store', [
+    lambda path: MemoryCooldownStore(3600, 600),
+    lambda path: SqliteCooldownStore(str(path / 'cooldowns.sqlite3'), cooldown=3600, hold=600),
+])
+def test_replayed_update_takes_over_only_a_dead_holders_reservation(tmp_path, make_store):
+    store = make_store(tmp_path)
+    
+    async def scenario():
+        _, _, dead_token = await store.reserve(3)
+        started = time.time()
+        status, _, token = await store.take_over(3, started)
+        # Yangi worker olgan rezervatsiyani ikkinchi replay tortib ololmaydi
+        again = (await store.take_over(3, started))[0]
+        # O'lgan worker'ning tokeni endi hech narsani o'zgartirmaydi
+        await store.cancel(3, dead_token)
+        still_held = (await store.reserve(3))[0]
+        await store.commit(3, token)
+        return status, again, still_held, (await store.reserve(3))[0], (await store.take_over(4, started))[0]
+    
+    assert asyncio.run(scenario()) == (RESERVED, IN_PROGRESS, IN_PROGRESS, COOLDOWN, RESERVED)
+
+
+def test_sqlite_reservations_are_granted_once_across_processes(tmp_path):
+    db_file = str(tmp_path / 'cooldowns.sqlite3')
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(PROCESSES)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=reserve_all, args=(db_file, barrier, results)) for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    granted = [grant for _ in processes for grant in results.get(timeout=120)]
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+    
+    assert sorted(user_id for user_id, _ in granted) == list(range(1, USERS + 1))
+    
+    # Har bir tokenni faqat egasi yakunlaydi
+    store = SqliteCooldownStore(db_file, cooldown=3600, hold=600)
+    user_id, token = granted[0]
+    assert asyncio.run(store.reserve(user_id))[0] == IN_PROGRESS
+    asyncio.run(store.commit(user_id, token))
+    assert asyncio.run(store.reserve(user_id))[0] == COOLDOWN
+
+
+def test_job_store_keeps_the_exact_reservation_token(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    token = time.time()
+    
+    async def scenario():
+        await store.add({'operation_name': 'op/1', 'chat_id': 1, 'user_id': 7,
+                         'submit_time': time.time(), 'reservation': token})
+        return await store.unfinished(), await store.has_unfinished(7), await store.has_unfinished(8)
+    
+    jobs, mine, other = asyncio.run(scenario())
+    assert jobs[0]['reservation'] == token
+    assert mine and not other
+
+
+@pytest.mark.parametrize('delivered, expected', [(True, COOLDOWN), (False, RESERVED)])
+def test_resumed_job_settles_its_reservation(tmp_path, monkeypatch, delivered, expected):
+    users = UserDatabase(JsonUserBackend(str(tmp_path / 'users.json')), MemoryCooldownStore(3600, 600))
+    monkeypatch.setattr(bot, 'user_db', users)
+    
+    async def fake_run(bot_instance, job):
+        return delivered
+    monkeypatch.setattr(bot, 'run_generation_job', fake_run)
+    
+    async def scenario():
+        _, _, token = await users.cooldowns.reserve(5)
+        job = {'operation_name': 'op/5', 'user_id': 5, 'reservation': token}
+        await bot.resume_generation_job(None, job)
+        return (await users.cooldowns.reserve(5))[0]
+    
+    # Yetkazilgan job cheklovni boshlaydi, muvaffaqiyatsizi slotni qaytaradi
+    assert asyncio.run(scenario()) == expected
@@ -0,0 +1,89 @@
+import random
+import time
+
+import pytest
+
+from bot import JournaledUserBackend, JsonUserBackend, SqliteUserBackend, migrate_json_users
+
+
+def make_backend(kind, tmp_path):
+    if kind == 'sqlite':
+        return SqliteUserBackend(str(tmp_path / 'users.sqlite3'))
+    if kind == 'journal':
+        return JournaledUserBackend(str(tmp_path / 'users.json'))
+    return JsonUserBackend(str(tmp_path / 'users.json'))
+
+
+def new_user(user_id, join_date):
+    return {
+        'user_id': user_id,
+        'username': f'u{user_id}',
+        'first_name': 'Test',
+        'videos_created': 0,
+        'last_video_time': 0,
+        'join_date': join_date,
+        'total_requests': 0
+    }
+
+
+@pytest.mark.parametrize('kind', ['sqlite', 'journal', 'json'])
+def test_statistics_match_a_full_scan(kind, tmp_path):
+    backend = make_backend(kind, tmp_path)
+    rng = random.Random(5)
+    now = time.time() - 3 * 86400
+    last_video = {}
+    videos = {}
+    for user_id in range(1, 201):
+        backend.insert(new_user(user_id, now))
+    
+    # Uch kun davomida tasodifiy videolar - chegaradagi soat ham tekshiriladi
+    for _ in range(1500):
+        now += rng.uniform(0, 170)
+        user_id = rng.randint(1, 200)
+        assert backend.record_video(user_id, now)
+        last_video[user_id] = now
+        videos[user_id] = videos.get(user_id, 0) + 1
+        
+        if rng.random() < 0.05:
+            active_since = now - 86400
+            stats = backend.stats(active_since)
+            assert stats['total_users'] == 200
+            assert stats['total_videos'] == sum(videos.values())
+            assert stats['active_today'] == sum(1 for t in last_video.values() if t > active_since)
+    
+    top = backend.top_users(10)
+    assert [user['videos_created'] for user in top] == sorted(videos.values(), reverse=True)[:10]
+
+
+def test_sqlite_buckets_are_seeded_from_migrated_users(tmp_path):
+    now = time.time()
+    legacy = JsonUserBackend(str(tmp_path / 'users.json'))
+    for user_id, age in [(1, 100), (2, 5000), (3, 90000)]:
+        record = new_user(user_id, now - age)
+        legacy.insert(record)
+        legacy.record_video(user_id, now - age)
+    
+    backend = SqliteUserBackend(str(tmp_path / 'users.sqlite3'))
+    assert migrate_json_users(str(tmp_path / 'users.json'), backend) == 3
+    assert backend.stats(now - 86400)['active_today'] == 2
+    assert backend.stats(now - 86400)['total_videos'] == 3
+
+
+def test_sqlite_buckets_are_seeded_for_an_existing_database(tmp_path):
+    now = time.time()
+    path = str(tmp_path / 'users.sqlite3')
+    old = SqliteUserBackend(path)
+    for user_id, age in [(1, 100), (2, 7300), (3, 90000)]:
+        old.insert(new_user(user_id, now - age))
+        old.record_video(user_id, now - age)
+    # Bucket jadvali paydo bo'lishidan oldingi baza
+    old._connection().execute("DROP TABLE active_buckets")
+    old._connection().commit()
+    
+    assert SqliteUserBackend(path).stats(now - 86400)['active_today'] == 2
+
+
+def test_sqlite_waits_as_long_as_the_cooldown_store_for_locks(tmp_path):
+    # BOT_WORKERS > 1: bir nechta jarayon bitta faylga yozadi - 5 s default juda qisqa
+    backend = SqliteUserBackend(str(tmp_path / 'users.sqlite3'))
+    assert backend._connection().execute("PRAGMA busy_timeout").fetchone()[0] == 30000
@@ -0,0 +1,75 @@
+import asyncio
+import base64
+import hashlib
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+from bot import LocalMediaStorage, VideoDelivery, VideoResultStore
+
+
+def read_back(delivery, payload):
+    async def scenario():
+        async with delivery.open({'bytesBase64Encoded': base64.b64encode(payload).decode('ascii')}) as f:
+            return f.read()
+    return asyncio.run(scenario())
+
+
+def test_small_video_is_decoded_in_memory(tmp_path):
+    payload = os.urandom(100_000)
+    assert read_back(VideoDelivery(spill_dir=str(tmp_path)), payload) == payload
+    assert os.listdir(tmp_path) == []
+
+
+def test_large_video_spills_and_is_removed(tmp_path):
+    payload = os.urandom(300_000)
+    delivery = VideoDelivery(spill_threshold=64 * 1024, spill_dir=str(tmp_path), chunk_size=50_000)
+    assert read_back(delivery, payload) == payload
+    assert os.listdir(tmp_path) == []
+
+
+def test_bucket_video_is_streamed_from_storage(tmp_path):
+    storage = LocalMediaStorage(str(tmp_path / 'bucket'))
+    payload = os.urandom(200_000)
+    
+    async def scenario():
+        uri = await storage.upload('out/video.mp4', payload, 'video/mp4')
+        delivery = VideoDelivery(spill_threshold=64 * 1024, spill_dir=str(tmp_path), storage=storage)
+        async with delivery.open({'gcsUri': uri}) as f:
+            return f.read()
+    
+    assert asyncio.run(scenario()) == payload
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+    
+    async def send_video(self, chat_id, video, **kwargs):
+        self.sent.append((chat_id, video))
+
+
+@pytest.mark.parametrize('analysis', [
+    None,  # default prompt - eng ko'p tasodifiy variant
+    {'face_count': 1, 'faces': [{'joy': 'LIKELY'}], 'labels': ['elderly', 'man', 'portrait']},
+])
+def test_same_photo_sent_twice_reuses_the_stored_video(monkeypatch, analysis):
+    monkeypatch.setattr(bot, 'video_results', VideoResultStore())
+    context = SimpleNamespace(bot=RecordingBot())
+    content_hash = hashlib.sha256(b'photo bytes').hexdigest()
+    
+    def send_photo():
+        # process_photo'dagi yo'l: stsenariy tanlash, so'ng saqlangan videoni qidirish
+        style = bot.video_results.style_for(content_hash, lambda: bot.image_analyzer.generate_uzbek_prompt(analysis))
+        return style, asyncio.run(bot.send_cached_video(context, 42, content_hash, style))
+    
+    style, reused = send_photo()
+    assert not reused
+    # Yangi video yetkazildi - run_generation_job job['result_key'] ostida saqlaydi
+    bot.video_results.put(VideoResultStore.make_key(content_hash, style['name'], style['prompt']), 'file-1')
+    
+    for _ in range(20):
+        assert send_photo()[1]
+    assert context.bot.sent == [(42, 'file-1')] * 20
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from google.cloud import vision
+
+from bot import VisionBatcher
+
+
+class FakeVision:
+    """batch_annotate_images that echoes each image back; optionally hangs or fails on batches"""
+    
+    def __init__(self, latency=0.02, hang_batches=False, fail_batches=False, fail_images=()):
+        self.latency = latency
+        self.hang_batches = hang_batches
+        self.fail_batches = fail_batches
+        self.fail_images = set(fail_images)
+        self.calls = []
+        self.release = threading.Event()
+    
+    def batch_annotate_images(self, requests, timeout=None):
+        contents = [request.image.content for request in requests]
+        self.calls.append(len(contents))
+        if len(contents) > 1 and self.hang_batches and not self.release.wait(timeout):
+            raise TimeoutError('deadline exceeded')  # gRPC DeadlineExceeded kabi
+        if len(contents) > 1 and self.fail_batches:
+            raise RuntimeError('batch rejected')
+        if self.fail_images.intersection(contents):
+            raise RuntimeError('bad image')
+        time.sleep(self.latency)
+        return SimpleNamespace(responses=contents)
+
+
+def request(index):
+    return vision.AnnotateImageRequest(image=vision.Image(content=f'image-{index}'.encode()))
+
+
+async def annotate_all(batcher, count):
+    return await asyncio.gather(*(batcher.annotate(request(i)) for i in range(count)), return_exceptions=True)
+
+
+def test_concurrent_requests_share_rpcs_and_get_their_own_response():
+    fake = FakeVision()
+    batcher = VisionBatcher(lambda: fake, window=0.05, max_batch=8)
+    batcher.gap = 0  # yuklama ostida: kelishlar oralig'i oynadan ancha kichik
+    
+    responses = asyncio.run(annotate_all(batcher, 20))
+    
+    assert responses == [f'image-{i}'.encode() for i in range(20)]
+    assert sum(fake.calls) == 20 and max(fake.calls) == 8 and len(fake.calls) <= 4
+    assert batcher.stats()['requests'] == 20
+
+
+def test_quiet_traffic_is_sent_at_once():
+    fake = FakeVision(latency=0)
+    batcher = VisionBatcher(lambda: fake, window=5)
+    
+    async def scenario():
+        started = time.perf_counter()
+        response = await batcher.annotate(request(1))
+        return response, time.perf_counter() - started
+    
+    response, elapsed = asyncio.run(scenario())
+    assert response == b'image-1' and elapsed < 1
+
+
+def test_hung_batch_times_out_and_falls_back_to_single_calls():
+    fake = FakeVision(hang_batches=True)
+    batcher = VisionBatcher(lambda: fake, window=0.05, timeout=0.3)
+    batcher.gap = 0
+    
+    responses = asyncio.run(annotate_all(batcher, 3))
+    fake.release.set()
+    
+    assert responses == [b'image-0', b'image-1', b'image-2']
+    assert fake.calls[0] == 3 and fake.calls[1:] == [1, 1, 1]
+    assert batcher.stats()['fallbacks'] == 1
+
+
+def test_failed_batch_only_fails_the_bad_image():
+    fake = FakeVision(fail_batches=True, fail_images={b'image-1'})
+    batcher = VisionBatcher(lambda: fake, window=0.05)
+    batcher.gap = 0
+    
+    responses = asyncio.run(annotate_all(batcher, 3))
+    
+    assert responses[0] == b'image-0' and responses[2] == b'image-2'
+    assert isinstance(responses[1], RuntimeError)
+
+
+def test_shutdown_cancels_queued_callers_and_later_calls_still_work():
+    fake = FakeVision(latency=0)
+    batcher = VisionBatcher(lambda: fake, window=10)
+    batcher.gap = 0
+    
+    async def scenario():
+        queued = asyncio.ensure_future(batcher.annotate(request(1)))
+        await asyncio.sleep(0.05)
+        batcher.shutdown()
+        results = await asyncio.gather(queued, return_exceptions=True)
+        return results[0], await asyncio.wait_for(batcher.annotate(request(2)), 5)
+    
+    queued, later = asyncio.run(scenario())
+    assert isinstance(queued, asyncio.CancelledError)
+    assert later == b'image-2'
+
+
+def test_burst_after_long_idle_is_batched():
+    fake = FakeVision()
+    batcher = VisionBatcher(lambda: fake, window=0.05)
+    batcher.last_arrival -= 600  # 10 daqiqa hech narsa kelmagan
+    
+    responses = asyncio.run(annotate_all(batcher, 30))
+    
+    assert responses == [f'image-{i}'.encode() for i in range(30)]
+    # Bir nechta birinchi so'rov darhol ketadi, qolgani batch'ga yig'iladi
+    assert len(fake.calls) <= 6 and max(fake.calls) >= 16
+    assert batcher.gap < batcher.window / 2
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import time
+
+from telegram.ext import Application, MessageHandler, filters
+from telegram.request import BaseRequest
+
+from bot import WebhookServer
+
+SECRET = 'test-secret'
+
+
+def synthetic_update(update_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': 1000 + update_id % 50, 'type': 'private'},
+            'from': {'id': 1000 + update_id % 50, 'is_bot': False, 'first_name': 'Test'},
+            'photo': [{'file_id': f'f{update_id}', 'file_unique_id': f'u{update_id}', 'width': 640, 'height': 480}]
+        }
+    }
+
+
+class FakeBotApi(BaseRequest):
+    """Bot API without network: getMe for initialize(), everything else just ok"""
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+    
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        result = {'id': 123456, 'is_bot': True, 'first_name': 'Test', 'username': 'test_bot'}
+        return 200, json.dumps({'ok': True, 'result': result if url.endswith('/getMe') else True}).encode()
+
+
+async def started_application(handler):
+    """Initialized and started PTB Application (concurrent updates, like build_application)"""
+    application = (
+        Application.builder()
+        .token('123456:TEST')
+        .request(FakeBotApi())
+        .get_updates_request(FakeBotApi())
+        .updater(None)
+        .concurrent_updates(True)
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.ALL, handler))
+    await application.initialize()
+    await application.start()
+    return application
+
+
+async def stop_application(application):
+    await application.stop()
+    await application.shutdown()
+
+
+async def request(reader, writer, method, path, body=b'', secret=SECRET):
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = int([line for line in head.split(b'\r\n') if line.lower().startswith(b'content-length')][0].split(b':')[1])
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def start_server(application, max_pending=100000):
+    server = WebhookServer(application, '/telegram', SECRET, max_pending=max_pending)
+    server._server = await asyncio.start_server(server._handle, '127.0.0.1', 0)
+    return server, server._server.sockets[0].getsockname()[1]
+
+
+def test_ingest_throughput_with_synthetic_updates():
+    total, connections = 4000, 20
+    
+    handled = []
+    
+    async def handler(update, context):
+        handled.append(update.message.photo[-1].file_unique_id)
+    
+    async def scenario():
+        application = await started_application(handler)
+        server, port = await start_server(application)
+        bodies = [json.dumps(synthetic_update(i)).encode() for i in range(total)]
+        
+        async def client(offset):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            statuses = [
+                (await request(reader, writer, 'POST', '/telegram', body))[0]
+                for body in bodies[offset::connections]
+            ]
+            writer.close()
+            return statuses
+        
+        started = time.perf_counter()
+        results = await asyncio.gather(*(client(offset) for offset in range(connections)))
+        elapsed = time.perf_counter() - started
+        while server.in_flight:
+            await asyncio.sleep(0.01)
+        await server.stop()
+        await stop_application(application)
+        return [status for statuses in results for status in statuses], elapsed
+    
+    statuses, elapsed = asyncio.run(scenario())
+    print(f"\nwebhook ingest: {total} updates over {connections} keep-alive connections "
+          f"in {elapsed:.2f} s = {total / elapsed:.0f} updates/s")
+    assert statuses == [200] * total
+    assert sorted(handled) == sorted(f'u{i}' for i in range(total))
+
+
+def test_secret_in_flight_limit_and_health():
+    async def scenario():
+        release = asyncio.Event()
+        
+        async def handler(update, context):
+            await release.wait()  # Uzoq ishlov (Veo kabi) - slot band turadi
+        
+        application = await started_application(handler)
+        server, port = await start_server(application, max_pending=10)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        bodies = [json.dumps(synthetic_update(i)).encode() for i in range(500)]
+        forbidden = (await request(reader, writer, 'POST', '/telegram', bodies[0], secret='wrong'))[0]
+        invalid = (await request(reader, writer, 'POST', '/telegram', b'{not json'))[0]
+        statuses = [(await request(reader, writer, 'POST', '/telegram', body))[0] for body in bodies]
+        busy = await request(reader, writer, 'GET', '/health')
+        
+        # Handler'lar tugagach slotlar bo'shaydi
+        release.set()
+        while server.in_flight:
+            await asyncio.sleep(0.01)
+        after = (await request(reader, writer, 'POST', '/telegram', bodies[0]))[0]
+        writer.close()
+        await server.stop()
+        await stop_application(application)
+        return forbidden, invalid, statuses, busy, after
+    
+    forbidden, invalid, statuses, (health_status, health), after = asyncio.run(scenario())
+    assert (forbidden, invalid) == (403, 400)
+    assert statuses == [200] * 10 + [503] * 490
+    assert health_status == 200 and health['pending'] == 10 and health['rejected'] == 490
+    assert after == 200